@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+import copy
+import multiprocessing
+import os
+import tempfile
 import numpy as np
 import matplotlib.pyplot as plt
 plt.rcParams['figure.figsize'] = (15,5)
@@ -14,10 +18,23 @@ class Community:
         String that represents the name of this community.
     
     space : numpy array
-        A 2D numpy array that represents all the individuals in the community.
+        A 2D numpy array of uint8 that represents all the individuals in the 
+        community: 0 is susceptible, 1 is infected, 2 is recovered and 3 is
+        immunised. With another compartment model, the codes are the 
+        positions of its states, followed by the immunised code. Empty 
+        positions hold the EMPTY code, 255. The counts are kept from the people
+        that change state in the transitions, so after changing the space by 
+        hand countStates has to be called before the next step, or immunise 
+        used instead.
     
     population : int
-        The size of the population.
+        The size of the population, which is the number of occupied positions.
+
+    occupancy : numpy array
+        2D boolean array which is False at the empty positions of the space, 
+        where nobody lives, or None if every position is occupied. Empty 
+        positions hold the EMPTY code, so they are never infected, counted or
+        drawn for. See setOccupancy.
 
     susceptible : int
         The number of susceptible people in the current state of the Community.
@@ -27,14 +44,84 @@ class Community:
     
     recovered : int
         The number of recovered people in the current state of the Community.
+
+    immunised : int
+        The number of immunised people in the current state of the Community,
+        which are not part of the SIR time series.
     
-    snapshots : list
-        List of 2D numpy arrays that represent the space at each step of the 
-        simulation.
+    snapshots : SnapshotHistory
+        List-like object with the 2D numpy arrays that represent the space at 
+        each step of the simulation. Instead of a copy per step, it keeps the 
+        step where each person was infected and recovered, and rebuilds the 
+        space of a step when it is accessed.
+
+    keep_snapshots : bool
+        Whether the snapshots are recorded.
+
+    snapshot_policy : tuple
+        The policy used to record the snapshots and its value, see 
+        setSnapshotPolicy.
+
+    verify_counts : bool
+        Whether the counts kept by the simulation are checked against a full
+        count of the space after every step.
+
+    random_draws : str
+        The kind of random numbers drawn in the transitions, see 
+        setRandomDraws.
+
+    transmission : str
+        How the number of infected neighbours affects the infection 
+        probability, see setTransmissionMode.
+
+    model : CompartmentModel
+        The compartments and the transitions between them, see 
+        setCompartmentModel. By default the SIR model.
+
+    neighbourhood : Neighbourhood
+        The neighbours of each person, their weights and what lies beyond the 
+        edges of the space, see setNeighbourhood. It is a Network in a 
+        NetworkCommunity.
+
+    probability_maps : dict
+        The factors that multiply the infection and recovery probabilities at
+        each position of the space, as a pair of a map and its lookup table, 
+        or None when the probability is the same everywhere, see 
+        setProbabilityMap.
+
+    schedule : dict
+        The changes of the parameters keyed by step, see setSchedule, or None.
+
+    recovery_mode : str
+        How the recoveries are drawn, see setRecoveryMode.
+
+    infectious_period : callable
+        The distribution of the infectious period in the scheduled recovery
+        mode, or None for the geometric one given by recovery_probability.
+
+    active_region : bool
+        Whether each step only draws random numbers and applies the transitions
+        in the box around the infected people grown by the radius of the 
+        neighbourhood, which is the only part of the space that can change.
+
+    dense_fraction : float
+        The fraction of the space covered by the active box above which the
+        whole space is updated instead.
+
+    region_cost : int
+        The number of positions whose update costs as much as updating one 
+        more region, used to choose between a single active box for all the 
+        replicates of a batched space or one box per replicate.
+
+    band_rows : int
+        The number of rows of each band when the space is stored in a file and
+        stepped one band at a time, see setOutOfCore, or None if the space is 
+        in memory.
     
     SIR : numpy array
         2D Numpy array that contains the number of susceptible, infected and 
-        recovered people in all the time steps of the simulation.
+        recovered people in all the time steps of the simulation. It is a view
+        of a preallocated buffer that grows by doubling its capacity.
     
     time : numpy array
         1D Numpy array that represents the time steps of the simulation.
@@ -55,6 +142,13 @@ class Community:
     total_infections : int
         This is the number of people that were infected at any point during the
         simulation.
+
+    duration_of_outbreak : int
+        This is the first time step of the simulation from which nobody is 
+        infected anymore, which is 0 if nobody was ever infected.
+
+    rng : numpy Generator
+        The random number generator used for every random draw in this community.
     
 
     Methods
@@ -68,9 +162,20 @@ class Community:
         equal to zero, cleaning the snapshots' list, and making both the SIR and
         time numpy arrays the same as in the moment of initialization.
     
-    addInitiallyInfected(number_initially_infected)
-        Set a number of initially infected people randomly scattered through
-        the community.
+    addInitiallyInfected(number_initially_infected, placement='random', center=None, region=None, mask=None)
+        Set a number of initially infected people scattered through the 
+        community, clustered around a point, inside a region or inside a mask.
+
+    immunise(fraction=1, placement='random', region=None, mask=None)
+        Immunises a fraction of the susceptible people of the whole community,
+        of a region, of a mask or around the infected people.
+
+    reserveSteps(steps)
+        Preallocates the SIR time series for the given number of steps.
+
+    fillRemainingSteps(steps)
+        Adds steps where nothing changes to the SIR time series without 
+        simulating them.
     
     simulateOneTimeStep()
         Advances the simulation by one step, and updates the SIR and time arrays.
@@ -82,7 +187,15 @@ class Community:
     infectedToRecovered()
         While advancing the simulation by one step, this method performs the
         conversion from infected to recovered.
+
+    countStates()
+        Counts the number of susceptible, infected and recovered people with a 
+        single pass over the space, updates such numbers and the number of 
+        immunised people, and returns the first three.
     
+    getSnapshot(step)
+        Returns the 2D numpy array representing the population at a given step.
+
     getSpace()
         Returns the 2D numpy array representing the population.
     
@@ -114,27 +227,113 @@ class Community:
     setRecoveryProbability(probability)
         Sets the recovery probability.
 
+    setProbabilityMap(which, values, table=None)
+        Sets a map of factors of the infection or recovery probability at each
+        position, as float32 values or uint8 levels with a lookup table.
+
+    setSeed(seed)
+        Replaces the random number generator by a new one created from a seed.
+
+    setOccupancy(mask)
+        Sets which positions of the space are occupied, leaving the rest empty.
+
+    setCompartmentModel(model)
+        Sets the compartments and the transitions between them.
+
+    getCompartment(state)
+        Counts the people in a state of the compartment model.
+
+    setTransmissionMode(mode)
+        Sets whether the infection probability is the same for any number of
+        infected neighbours, or it comes from independent contacts.
+
+    setNeighbourhood(kind='moore', radius=1, kernel=None, boundary='zero', method=None)
+        Sets the neighbours of each person, as a von Neumann, Moore or circular
+        neighbourhood of some radius or a weighted kernel, and the boundary of
+        the space.
+
+    setSchedule(schedule)
+        Sets the changes of the infection and recovery probabilities, and the
+        vaccination pulses, at given steps of the simulations.
+
+    setRecoveryMode(mode, infectious_period=None)
+        Sets whether every infected person draws a recovery at every step, or 
+        the recovery step is drawn once when a person is infected.
+
+    setRandomDraws(kind)
+        Sets the kind of random numbers drawn in the transitions: float64, 
+        float32 or 32-bit integers.
+
+    setSnapshotPolicy(policy, value=None)
+        Sets which snapshots are recorded: all of them, none, every k-th step,
+        the last N steps or a list of steps.
+
+    setOutOfCore(filename=None, band_rows=1024)
+        Stores the space in a file and steps it one band of rows at a time, for
+        spaces larger than the memory.
+
     """
 
+    # the code of the empty positions, which is left out of every transition and count
+    EMPTY = 255
+
+    # the number of positions handled at once by the passes that would otherwise need large temporary arrays
+    CHUNK_SIZE = 2**20
+
+    # the attributes that hold the space and the simulated data, the rest are settings
+    SIMULATED_DATA = ('space', 'susceptible', 'infected', 'recovered', 'immunised', 'snapshots', '_SIR_buffer', '_SIR_length', 
+                      'time', 'peak_number_of_infections', 'total_infections', 'duration_of_outbreak', '_active_box', 
+                      '_band_infected', '_recoveries', '_region', '_halo_rows', 'rng')
+
     # initalization method
-    def __init__(self, name, pop_sqrt):
+    def __init__(self, name, pop_sqrt, seed=None):
         """
         Parameters
         ----------
         name : String
             String that represents the name of this community.
         
-        pop_sqrt : int
-            Integer which is the square root of the desired population size.
+        pop_sqrt : int or tuple
+            Integer which is the square root of the desired population size, or
+            the (rows, columns) of a rectangular community.
+
+        seed : int or SeedSequence, optional
+            The seed of the random number generator of this community. By default
+            the generator is seeded with fresh entropy.
         """
 
+        shape = tuple(pop_sqrt) if np.ndim(pop_sqrt) else (pop_sqrt, pop_sqrt)
+
         self.name = name # name of the community
-        self.space = np.zeros((pop_sqrt,pop_sqrt)) # numpy array that represents the physical space
+        self.space = np.zeros(shape, dtype=np.uint8) # numpy array that represents the physical space, 0, 1 and 2 fit in a single byte
+        self.occupancy = None # where people live, None if they live everywhere
         self.population = self.space.size # the size of the population
         self.susceptible = self.space.size # the current number of healthy people in the population
         self.infected = 0 # the current number of infected people in the population
         self.recovered = 0 # the current number of infected people in the population
-        self.snapshots = [] # this will contain numpy arrays that represent each time step
+        self.immunised = 0 # the current number of immunised people in the population
+        self.model = SIR # the compartments and the transitions between them
+        self.snapshot_policy = ('all', None) # which snapshots are recorded
+        self.keep_snapshots = True # whether the snapshots are recorded
+        self.snapshots = self._newSnapshots() # this will contain numpy arrays that represent each time step
+        self.verify_counts = False # whether the kept counts are checked against a full count after every step
+        self.random_draws = 'float64' # the kind of random numbers drawn in the transitions
+        self.transmission = 'any' # how the number of infected neighbours affects the infection probability
+        self.neighbourhood = Neighbourhood() # the neighbours of each person and the boundary of the space
+        self.probability_maps = {'infection': None, 'recovery': None} # the factors of the probabilities at each position, if any
+        self.schedule = None # the changes of the parameters keyed by step, if any
+        self._schedule = None # the schedule as per step arrays
+        self.recovery_mode = 'bernoulli' # how the recoveries are drawn
+        self.infectious_period = None # the distribution of the infectious period in the scheduled recovery mode
+        self._recoveries = None # the positions that recover at each step in the scheduled recovery mode, None if they have to be drawn again
+        self.active_region = True # whether steps only update the box around the infected people
+        self.dense_fraction = 0.5 # the fraction of the space above which the whole space is updated instead
+        self.region_cost = 2**14 # the positions that updating one more region costs, when every replicate gets its own
+        self.band_rows = None # the rows of each band when the space is stored in a file, None if it is in memory
+        self._band_infected = None # the bands and the number of infected people in each of them, None if they have to be counted again
+        self._halo_rows = None # the infected rows beyond the band being updated, None beyond the edges of the space
+        self._active_box = None # the box around the infected people of every replicate, None if it has to be found again
+        self._region = (Ellipsis,) # the region of the space updated by the transitions
         self.SIR = np.zeros((3,1)) #this contains a time series of the number of susceptible, infected, recovered
         self.time = np.zeros(1) # this array will be the time array
         self.base_infection_probability = 0 # this is the base infection probability
@@ -142,6 +341,8 @@ class Community:
         self.recovery_probability = 0 # this is the probability of recovering if the person is infected
         self.peak_number_of_infections = 0 # this is the peak number of infected people at the same time during the simulation
         self.total_infections = 0 # this is the total number of people that were infected or are currently infected at the time where the outbreak ends
+        self.duration_of_outbreak = 0 # this is the first time step where nobody is infected
+        self.rng = np.random.default_rng(seed) # the random number generator used for every random draw in this community
 
     def resetSimulatedData(self):
         """If a simulation has been run, then all of the simulated data is stored
@@ -153,348 +354,3717 @@ class Community:
         time numpy arrays the same as in the moment of initialization.
 
         """
-        self.space = 0*self.space # numpy array that represents the physical space
-        self.susceptible = self.space.size # the current number of healthy people in the population
+        if self.band_rows is None:
+            self.space = np.zeros_like(self.space) # numpy array that represents the physical space
+            self._applyOccupancy() # the empty positions stay empty
+        else:
+            self._clearBands() # the space stays in its file
+        self.susceptible = self.population # the current number of healthy people in the population
         self.infected = 0 # the current number of infected people in the population
         self.recovered = 0 # the current number of infected people in the population
-        self.snapshots = [] # this will contain numpy arrays that represent each time step
-        self.SIR = np.zeros((3,1)) #this contains a time series of the number of susceptible, infected, recovered
+        self.immunised = 0 # the current number of immunised people in the population
+        self.snapshots = self._newSnapshots() # this will contain numpy arrays that represent each time step
+        self._resetSIR() # this contains a time series of the number of susceptible, infected, recovered
         self.time = np.zeros(1) # this array will be the time array
         self.total_infections = 0 # set the number of total infections back to zero
+        self._active_box = None # the box around the infected people has to be found again
+        self._band_infected = None # the infected people of each band have to be counted again
+        self._recoveries = None # the recoveries have to be drawn again
+        self._applySchedule(0, pulses=False) # the probabilities go back to the ones at the start of the schedule
 
     # method to add the initially infected
-    def addInitiallyInfected(self, number_initially_infected):
-        """Set a number of initially infected people randomly scattered through
-        the community.
+    def addInitiallyInfected(self, number_initially_infected, placement='random', center=None, region=None, mask=None):
+        """Set a number of initially infected people in the community, placed
+        among the susceptible people without any loop over positions. If the
+        space is batched, every replicate is seeded at once.
 
         Parameters
         ----------
         number_initially_infected : int
             The number of initially infected people in the population.
+        placement : str, optional
+            'random' scatters them through the whole community, 'clustered' 
+            infects the people closest to center, 'region' scatters them inside
+            region, and 'mask' scatters them where mask is True. Default value 
+            is set to 'random'.
+        center : tuple, optional
+            The (row, column) used by 'clustered'. By default the middle of the
+            community.
+        region : tuple, optional
+            The (first row, last row + 1, first column, last column + 1) used by
+            'region'.
+        mask : numpy array, optional
+            The 2D boolean array used by 'mask'.
 
         """
 
-        x_infected = 0
-        y_infected = 0
+        if placement == 'random' and self.space.size == self.space.shape[-2] * self.space.shape[-1]:
+            # a single space, so positions are drawn until enough susceptible people are found, instead of listing them
+            infected = int(np.sum(self.countStates()[1]))
+            self._infectRandomPositions(max(number_initially_infected - infected, 0))
+            self.SIR[..., 0] = np.stack(self.countStates(), axis=-1)
+            if self.keep_snapshots:
+                self.snapshots.start(self.getSpace())
+            return
+
+        rows, cols = self.space.shape[-2:]
+        flat_space = self.space.reshape(-1, rows * cols)
+
+        # where the infected can be placed
+        allowed = np.ones((rows, cols), dtype=bool)
+        if placement == 'region':
+            allowed[:] = False
+            allowed[region[0]:region[1], region[2]:region[3]] = True
+        elif placement == 'mask':
+            allowed = np.asarray(mask, dtype=bool)
+        elif placement not in ('random', 'clustered'):
+            raise ValueError('Unknown placement {!r}.'.format(placement))
+        candidates = np.logical_and(flat_space == 0, allowed.ravel())
+
+        # how many new infected are needed in each replicate
+        infected = np.reshape(self.countStates()[1], -1)
+        missing = np.maximum(number_initially_infected - infected, 0)
+        if np.any(missing > np.count_nonzero(candidates, axis=1)):
+            raise ValueError('There are not enough susceptible people to infect.')
+
+        if placement == 'clustered':
+            # the closest people come first, people at the same distance are taken at random
+            if center is None:
+                center = (rows // 2, cols // 2)
+            distance = np.add.outer((np.arange(rows) - center[0])**2, (np.arange(cols) - center[1])**2).ravel()
+            self._infectSmallestKeys(flat_space, candidates, missing, distance + self.rng.random(flat_space.shape))
+        else:
+            self._infectSmallestKeys(flat_space, candidates, missing, self.rng.random(flat_space.shape, dtype=np.float32))
+
+        # add the initial values of healthy/infected/recovered to the arrays keeping track, counted in a single pass
+        self.SIR[..., 0] = np.stack(self.countStates(), axis=-1)
 
-        # place as many infected as required in this loop
-        while self.infected < number_initially_infected:
-            
-            # randomly generate the position
-            x_infected = np.random.randint(0,self.space.shape[0])
-            y_infected = np.random.randint(0,self.space.shape[1])
-            
-            # check that the position isn't already occupied by an infected
-            if (self.space[x_infected][y_infected] == 0):
-                self.space[x_infected][y_infected] = 1
-                self.infected += 1
+        # add the first snapshot of the simulation
+        if self.keep_snapshots:
+            self.snapshots.start(self.getSpace())
 
-        # add the initial values of healthy/infected to the arrays keeping track
-        self.SIR[0, 0] = self.getSusceptible()
-        self.SIR[1, 0] = self.getInfected()
+    def immunise(self, fraction=1, placement='random', region=None, mask=None):
+        """Immunises a fraction of the susceptible people, drawing a random 
+        number only for the eligible ones and updating the counts. If the space
+        is batched, every replicate is immunised at once.
 
-        # add the first snapshot of the simulation
-        self.snapshots.append(self.getSpace().copy())
+        Parameters
+        ----------
+        fraction : float or numpy array, optional
+            The probability that each eligible person is immunised, or one 
+            probability per member of a stacked space. By default all of them
+            are.
+        placement : str, optional
+            'random' takes the susceptible people of the whole community, 
+            'region' the ones inside region, 'mask' the ones where mask is True
+            and 'ring' the ones with an infected neighbour. Default value is 
+            set to 'random'.
+        region : tuple, optional
+            The (first row, last row + 1, first column, last column + 1) used by
+            'region'.
+        mask : numpy array, optional
+            The 2D boolean array used by 'mask'.
+
+        Returns
+        -------
+        immunised : int or numpy array
+            The number of people immunised, per replicate if the space is 
+            batched.
+
+        """
+
+        if placement not in ('random', 'region', 'mask', 'ring'):
+            raise ValueError('Unknown placement {!r}.'.format(placement))
+
+        # the immunised people show up in the snapshot of the next step
+        if self.keep_snapshots and len(self.snapshots) == 0:
+            self.snapshots.start(self.getSpace())
+
+        if self.band_rows is None:
+            immunised = self._immuniseArea((Ellipsis,), fraction, placement, region, mask)
+        else:
+            # a space stored in a file is immunised one band at a time, with the infected rows around it for the ring
+            immunised = 0
+            for top, bottom in self._bands():
+                self._halo_rows = self._bandHalo(top, bottom)
+                immunised += self._immuniseArea((Ellipsis, slice(top, bottom), slice(0, self.space.shape[-1])), fraction, placement, region, mask)
+            self._halo_rows = None
+
+        self.susceptible = self.susceptible - immunised
+        self.immunised = self.immunised + immunised
+
+        return immunised
+
+    def _immuniseArea(self, area, fraction, placement, region, mask):
+        """Immunises a fraction of the eligible susceptible people inside an 
+        area of the space, as described in immunise.
+
+        Parameters
+        ----------
+        area : tuple
+            The index of the area of the space.
+
+        The remaining parameters are the same as in immunise.
+
+        Returns
+        -------
+        immunised : int or numpy array
+            The number of people immunised, per replicate if the space is 
+            batched.
+
+        """
+
+        space = self.space[area]
+        buffers = self._workBuffers(space.shape)
+        eligible = np.equal(space, 0, out=buffers['mask'])
+
+        if placement == 'region':
+            top, left = (0, 0) if len(area) == 1 else (area[1].start, area[2].start)
+            inside = np.zeros(space.shape[-2:], dtype=bool)
+            inside[max(region[0] - top, 0):max(region[1] - top, 0), max(region[2] - left, 0):max(region[3] - left, 0)] = True
+            np.logical_and(eligible, inside, out=eligible)
+        elif placement == 'mask':
+            np.logical_and(eligible, np.asarray(mask, dtype=bool)[area], out=eligible)
+        elif placement == 'ring':
+            # the contacts of the infected people, as given by the neighbourhood
+            exposed = np.greater(self._countInfectedNeighbours(area), 0, out=buffers['other_mask'])
+            np.logical_and(eligible, exposed, out=eligible)
+
+        positions = np.flatnonzero(eligible)
+        if np.ndim(fraction) > 0:
+            # one fraction per member of a stacked space, as in a Metapopulation
+            fraction = np.asarray(fraction)[positions // (space.shape[-2] * space.shape[-1])]
+        if np.any(np.less(fraction, 1)):
+            positions = positions[self._drawBelow(fraction, positions.size)]
+        return self._changeState(area, positions, self.model.immunised)
+
+    def _infectRandomPositions(self, missing):
+        """Infects as many random susceptible people as are missing, drawing 
+        random positions of the space and keeping the distinct ones that are
+        susceptible, in the order they were drawn, until there are enough. No
+        array of the size of the space is created.
+
+        Parameters
+        ----------
+        missing : int
+            The number of people to infect.
+
+        """
+
+        susceptible = int(np.sum(self.susceptible))
+        if missing > susceptible:
+            raise ValueError('There are not enough susceptible people to infect.')
+
+        flat_space = self.space.reshape(-1)
+        chosen = np.zeros(0, dtype=np.int64)
+        while chosen.size < missing:
+            # twice the expected number of draws, up to a bounded batch when few people are susceptible
+            needed = 2 * (missing - chosen.size)
+            size = max(needed, min(-(-needed * flat_space.size // susceptible), self.CHUNK_SIZE))
+            drawn = self.rng.integers(0, flat_space.size, size=size)
+            drawn = np.concatenate([chosen, drawn[flat_space[drawn] == 0]])
+            first = np.sort(np.unique(drawn, return_index=True)[1])
+            chosen = drawn[first]
+        chosen = np.sort(chosen[:missing])
+        flat_space[chosen] = self.model.seed
+
+    def _infectSmallestKeys(self, flat_space, candidates, missing, keys):
+        """Infects, in every row of the flat space, the candidates with the 
+        smallest keys, as many as are missing in that row.
+
+        Parameters
+        ----------
+        flat_space : numpy array
+            The space with one row per replicate.
+        candidates : numpy array
+            Boolean array with the positions that can be infected.
+        missing : numpy array
+            The number of people to infect in each row.
+        keys : numpy array
+            The keys of every position, which are overwritten.
+
+        """
+
+        if np.all(missing == 0):
+            return
 
+        keys[~candidates] = np.inf
+        most = missing.max()
+        chosen = np.argpartition(keys, most - 1, axis=1)[:, :most]
+        chosen = np.take_along_axis(chosen, np.argsort(np.take_along_axis(keys, chosen, axis=1), axis=1), axis=1)
+
+        # only keep as many as are missing in each row
+        runs, ranks = np.nonzero(np.arange(most) < missing[:, np.newaxis])
+        flat_space[runs, chosen[runs, ranks]] = self.model.seed
 
     # method that simulates one time step
     def simulateOneTimeStep(self):
         """Advances the simulation by one step, and updates the SIR and time 
-        arrays.
+        arrays. The counts are updated with the people that change state, so 
+        changes made to the space by hand are only taken into account after 
+        calling countStates.
 
         """
 
-        self.susceptibleToInfected()
-        self.infectedToRecovered()
+        # the snapshots start from the current space if no people were added
+        if self.keep_snapshots and len(self.snapshots) == 0:
+            self.snapshots.start(self.getSpace())
+
+        # the parameters of this step, and its vaccination pulse
+        self._applySchedule(self._SIR_length - 1)
+
+        if self.model.fast and self.band_rows is not None:
+            # the space is in a file, so it is stepped one band of rows at a time
+            new_infected, new_recovered = self._stepBands()
+
+            # update the counts with the number of people that changed state, instead of counting again
+            self.susceptible = self.susceptible - new_infected
+            self.infected = self.infected + new_infected - new_recovered
+            self.recovered = self.recovered + new_recovered
+        elif self.model.fast:
+            # only the infected people and their neighbours can change state in this step, inside a single
+            # region or one region per replicate, and everybody is infected before anybody recovers
+            regions = self._activeRegions()
+            new_infected, new_recovered = 0, 0
+            for region in regions:
+                self._region = region
+                new_infected = new_infected + self.susceptibleToInfected()
+            for region in regions:
+                self._region = region
+                new_recovered = new_recovered + self.infectedToRecovered()
+
+            # the infected people are now all inside the regions that were updated
+            self._updateActiveBox(regions)
+            self._region = (Ellipsis,)
+
+            # update the counts with the number of people that changed state, instead of counting again
+            self.susceptible = self.susceptible - new_infected
+            self.infected = self.infected + new_infected - new_recovered
+            self.recovered = self.recovered + new_recovered
+        else:
+            # the transitions of the compartment model, which update the counts themselves
+            self._applyModelTransitions()
+
+        if self.verify_counts:
+            self._verifyCounts()
 
         # add the new values of healthy/infected/recovered to the arrays keeping track
-        SIR_t = np.array([self.getSusceptible(), self.getInfected(), self.getRecovered()])
+        SIR_t = np.stack([self.susceptible, self.infected, self.recovered], axis=-1)
         #update SIR time series
-        self.SIR = np.concatenate([self.SIR, SIR_t[:,np.newaxis]], axis=1)
+        self._appendSIR(SIR_t)
 
-        # add the new snapshot of the simulation
-        self.snapshots.append(self.getSpace().copy())
+        # add the new snapshot of the simulation, whose changes were recorded by the transitions
+        if self.keep_snapshots:
+            self.snapshots.extend(1, self.getSpace())
     
     def susceptibleToInfected(self):
         """While advancing the simulation by one step, this method performs the 
-        conversion from susceptible to infected.
+        conversion from susceptible to infected. Only the healthy people with
+        at least one infected neighbour draw a random number.
+
+        Returns
+        -------
+        new_infected : int
+            The number of people that were infected in this step.
 
         """
 
-        #create a mask to sieve those uninfected out
-        infected = self.space == 1
+        space = self.space[self._region]
+        buffers = self._workBuffers(space.shape)
+
+        # how many infected are around each position
+        count = self._countInfectedNeighbours(self._region)
 
-        # add extra boundaries
-        expan1 = np.hstack((infected,np.zeros((self.space.shape[0],1))))
-        expan1 = np.vstack((expan1,np.zeros((1,expan1.shape[1]))))
-        expan1 = np.hstack((np.zeros((expan1.shape[0],1)),expan1))
-        expan1 = np.vstack((np.zeros((1,expan1.shape[1])),expan1))
+        # the healthy people with at least one infected neighbour
+        exposedToRisk = np.greater(count, 0, out=buffers['mask'])
+        np.logical_and(exposedToRisk, np.equal(space, 0, out=buffers['other_mask']), out=exposedToRisk)
+        exposed = np.flatnonzero(exposedToRisk)
 
-        # make the addition for how many infected are around each position
-        expan2 = (expan1[:-2,:-2] + 
-                    expan1[:-2,1:-1] + 
-                    expan1[:-2,2:] + 
-                    expan1[1:-1,2:] + 
-                    expan1[2:,2:] + 
-                    expan1[2:,1:-1] + 
-                    expan1[2:,0:-2] + 
-                    expan1[1:-1,0:-2])
+        # around infection_probability % of the exposed people are infected, or with per contact 
+        # transmission, the probability of each one is looked up from its number of infected neighbours
+        probability = self._probability('infection', exposed, self._region)
+        if self.transmission == 'per_contact' and np.ndim(probability) == 0 and self.neighbourhood.dtype.kind != 'f':
+            probability = self._transmissionTable()[count.reshape(-1)[exposed]]
+        elif self.transmission == 'per_contact':
+            probability = 1 - (1 - probability) ** count.reshape(-1)[exposed]
+        newly_infected = exposed[self._drawBelow(probability, exposed.size)]
 
-        exposedToRisk = np.logical_and(expan2 > 0, self.space == 0)
-        # initialize a random matrix where around infection_probability % of the values are True
-        infect_prob_arr = np.random.rand(self.space.shape[0], self.space.shape[1]) < self.infection_probability
-        # find the overlap between healthy and 
-        self.space[np.logical_and(exposedToRisk, infect_prob_arr)] = 1
+        # the box around the infected people has to be found again
+        self._active_box = None
+
+        return self._changeState(self._region, newly_infected, 1)
 
     def infectedToRecovered(self):
         """While advancing the simulation by one step, this method performs the
-        conversion from infected to recovered.
+        conversion from infected to recovered. Only the infected people draw a
+        random number.
+
+        Returns
+        -------
+        new_recovered : int
+            The number of people that recovered in this step.
 
         """
 
-        # initialize a random matrix where around recovery_probability % of the values are True
-        recover_prob_arr = np.random.rand(self.space.shape[0],self.space.shape[1]) < self.recovery_probability
-        # find the overlap between infected and above array and make those people recovered
-        self.space[np.logical_and(self.space == 1, recover_prob_arr)] = 2
+        if self.recovery_mode == 'scheduled':
+            return self._applyScheduledRecoveries()
 
+        space = self.space[self._region]
+        buffers = self._workBuffers(space.shape)
 
-    # get methods
-    def getSpace(self):
-        """ Returns the 2D numpy array representing the population.
+        # around recovery_probability % of the infected people recover
+        infected = np.flatnonzero(np.equal(space, 1, out=buffers['mask']))
+        newly_recovered = infected[self._drawBelow(self._probability('recovery', infected, self._region), infected.size)]
+
+        return self._changeState(self._region, newly_recovered, 2)
+
+    def _stepBands(self):
+        """Advances a space stored in a file by one step, one band of rows at a
+        time, so that only a band and its halo are in memory. Each band is 
+        updated in place with the same transitions as the whole space, with 
+        the rows beyond it as its halo. The rows below a band have not changed
+        yet when it is updated, and the last rows of each band are kept as 
+        they were before the step to be the halo of the next one. Bands 
+        without infected people in them or in the bands next to them are not
+        read, since nothing in them can change.
 
         Returns
         -------
-        space : numpy 2D array
-            The current state of the community.
+        new_infected : int
+            The number of people that were infected in this step.
+        new_recovered : int
+            The number of people that recovered in this step.
 
         """
-        return self.space
 
-    def getName(self):
-        """Returns the name of the community.
+        if self.space.ndim != 2 or isinstance(self.neighbourhood, Network) or self.recovery_mode != 'bernoulli':
+            raise ValueError('A space in a file is only stepped with the SIR model, bernoulli recoveries and a lattice neighbourhood.')
+
+        space = self.space
+        rows, cols = space.shape
+        radius_rows = self.neighbourhood.radius[0]
+        bands, infected = self._bandInfected()
+        # whether a band can change depends on the infected people before the step, not on the bands already updated
+        before = infected.copy()
+        periodic = self.neighbourhood.boundary == 'periodic' and len(bands) > 1 and radius_rows > 0
+
+        # with periodic boundaries the first band takes the last rows as its halo, and the last band the first rows before they change
+        above = np.equal(space[rows - radius_rows:], 1) if periodic else None
+        wrapped = np.equal(space[:radius_rows], 1) if periodic else None
+
+        new_infected, new_recovered = 0, 0
+        for index, (top, bottom) in enumerate(bands):
+            near = [index - 1, index, index + 1]
+            near = [band % len(bands) for band in near] if periodic else [band for band in near if 0 <= band < len(bands)]
+            if not np.any(before[near]):
+                # nobody in this band is infected, so it is an empty halo for the next one
+                above = None
+                continue
+
+            if bottom < rows:
+                below = np.equal(space[bottom:bottom + radius_rows], 1)
+            else:
+                below = wrapped
+            next_above = np.equal(space[bottom - radius_rows:bottom], 1) if radius_rows else None
+
+            self._region = (Ellipsis, slice(top, bottom), slice(0, cols))
+            self._halo_rows = (above, below)
+            band_infected = self.susceptibleToInfected()
+            band_recovered = self.infectedToRecovered()
+
+            infected[index] += band_infected - band_recovered
+            new_infected += band_infected
+            new_recovered += band_recovered
+            above = next_above
+
+        self._region = (Ellipsis,)
+        self._halo_rows = None
+
+        return new_infected, new_recovered
+
+    def _bands(self):
+        """Returns the bands of rows in which a space stored in a file is 
+        stepped. Each band has at least as many rows as the radius of the 
+        neighbourhood, so a last band thinner than that is merged into the
+        previous one.
 
         Returns
         -------
-        name : str
-            The comunnity's name.
+        bands : list
+            The (first row, last row + 1) of every band.
 
         """
 
-        return self.name
+        rows = self.space.shape[-2]
+        radius_rows = self.neighbourhood.radius[0]
+        starts = list(range(0, rows, max(self.band_rows, radius_rows, 1)))
+        if len(starts) > 1 and rows - starts[-1] < radius_rows:
+            starts.pop()
+        return list(zip(starts, starts[1:] + [rows]))
 
-    def getPopulation(self):
-        """Returns the size of the population.
+    def _bandHalo(self, top, bottom):
+        """Returns the infected masks of the rows above and below a band of a 
+        space stored in a file, as they are in the space. Beyond the edges of a
+        periodic space they are the rows at the opposite edge, and beyond the
+        other edges they are None, so the halo follows the boundary.
+
+        Parameters
+        ----------
+        top : int
+            The first row of the band.
+        bottom : int
+            The last row of the band + 1.
 
         Returns
         -------
-        population : int
-            The comunnity's population.
+        halo_rows : tuple
+            The masks of the rows above and below the band.
 
         """
 
-        return self.population
-
-    def getSusceptible(self):
-        """Calculates the number of susceptible from the current state of the space,
-        updates such number and returns it.
+        rows = self.space.shape[-2]
+        radius_rows = self.neighbourhood.radius[0]
+        periodic = self.neighbourhood.boundary == 'periodic' and (top > 0 or bottom < rows)
+
+        if top > 0:
+            above = np.equal(self.space[top - radius_rows:top], 1)
+        else:
+            above = np.equal(self.space[rows - radius_rows:], 1) if periodic else None
+        if bottom < rows:
+            below = np.equal(self.space[bottom:bottom + radius_rows], 1)
+        else:
+            below = np.equal(self.space[:radius_rows], 1) if periodic else None
+        return above, below
+
+    def _bandInfected(self):
+        """Returns the bands of a space stored in a file and the number of 
+        infected people in each of them, counting them one band at a time if
+        the space was changed since they were last kept.
 
         Returns
         -------
-        susceptible : int
-            The comunnity's population that is susceptible.
+        bands : list
+            The (first row, last row + 1) of every band.
+        infected : numpy array
+            The number of infected people in each band, which the steps keep 
+            up to date.
 
         """
 
-        # use a mask and sum it to see the number of healthy people, designated as having a value equal to zero
-        self.susceptible = np.sum((self.getSpace()) == 0)
+        bands = self._bands()
+        if self._band_infected is None or self._band_infected[0] != bands:
+            infected = np.array([np.count_nonzero(self.space[top:bottom] == 1) for top, bottom in bands], dtype=np.int64)
+            self._band_infected = (bands, infected)
+        return self._band_infected
 
-        return self.susceptible
+    def _clearBands(self):
+        """Makes everybody susceptible in a space stored in a file, one band
+        at a time, leaving the empty positions empty.
 
-    def getInfected(self):
-        """Calculates the number of infected from the current state of the space,
-        updates such number and returns it.
+        """
+
+        for top, bottom in self._bands():
+            self.space[top:bottom] = 0
+            if self.occupancy is not None:
+                self.space[top:bottom][~self.occupancy[top:bottom]] = self.EMPTY
+        self.space.flush()
+
+    def _applyModelTransitions(self):
+        """Performs the transitions of a compartment model. As with the SIR 
+        model, the transitions triggered by exposure happen first, and then the
+        ones with a probability at every step, over the updated space. In each
+        phase the people that can change state are found with a lookup by 
+        state code, each of them draws a single random number, and the 
+        cumulative probabilities of the competing transitions of their state
+        tell which one happens, if any. The counts are updated with the people
+        that changed state.
+
+        """
+
+        model = self.model
+        # the empty margins of the space never change state
+        region = self._occupiedRegion()
+        space = self.space[region]
+        buffers = self._workBuffers(space.shape)
+
+        # how many infectious people are around each position, before anybody changes state
+        count = self._countInfectedNeighbours(region, model.infectious_table)
+
+        for kind, which, table in ((model.EXPOSURE, 'infection', model.exposure_table), 
+                                   (model.PROBABILITY, 'recovery', model.probability_table)):
+            candidates = np.take(table, space, out=buffers['mask'])
+            if kind == model.EXPOSURE:
+                np.logical_and(candidates, np.greater(count, 0, out=buffers['other_mask']), out=candidates)
+            positions = np.flatnonzero(candidates)
+            states = space[np.unravel_index(positions, space.shape)]
+
+            # the probabilities of the competing transitions of this kind, the unset ones come from the community
+            probabilities = np.where(model.kinds[states] == kind, model.probabilities[states], 0)
+            unset = np.isnan(probabilities)
+            if np.any(unset):
+                rows, columns = np.nonzero(unset)
+                probabilities[rows, columns] = (self._probability(which, positions, region) * np.ones(positions.size))[rows]
+            if kind == model.EXPOSURE and self.transmission == 'per_contact':
+                probabilities = 1 - (1 - probabilities) ** count.reshape(-1)[positions][:, np.newaxis]
+
+            # a single draw picks one of the transitions, or none when it is above all of them
+            chosen = np.sum(self._uniformDraws(positions.size)[:, np.newaxis] >= np.cumsum(probabilities, axis=1), axis=1)
+            targets = model.targets[states, chosen]
+            changed = targets != states
+            positions, states, targets = positions[changed], states[changed], targets[changed]
+
+            # the change of the counts of every replicate
+            delta = model.summary[targets] - model.summary[states]
+            if space.ndim == 2:
+                delta = delta.sum(axis=0)
+            else:
+                replicates = space.shape[:-2]
+                runs = positions // (space.shape[-2] * space.shape[-1])
+                delta = np.stack([np.bincount(runs, weights=delta[:, column], minlength=int(np.prod(replicates))) 
+                                  for column in range(3)], axis=-1).astype(np.int64).reshape(replicates + (3,))
+            self.susceptible = self.susceptible + delta[..., 0]
+            self.infected = self.infected + delta[..., 1]
+            self.recovered = self.recovered + delta[..., 2]
+
+            for target in np.unique(targets):
+                self._changeState(region, positions[targets == target], target)
+
+    def _uniformDraws(self, size):
+        """Draws size random numbers in [0, 1) with the kind of draws set by
+        setRandomDraws.
+
+        """
+
+        if self.random_draws == 'integer':
+            return self.rng.integers(0, 2**32, size=size, dtype=np.uint32) / 2**32
+        if self.random_draws == 'float32':
+            return self.rng.random(size, dtype=np.float32)
+        return self.rng.random(size)
+
+    def _scheduleRecoveries(self, positions):
+        """Draws the step where each of the newly infected people at the given
+        positions recovers, and adds them to the bucket of that step. The 
+        first step where they can recover is the current one.
+
+        Parameters
+        ----------
+        positions : numpy array
+            The flat positions in the whole space.
+
+        """
+
+        if self.infectious_period is None and (self.probability_maps['recovery'] is not None or np.ndim(self.recovery_probability) > 0):
+            # the number of recovery draws until the first success, with the probability of each position
+            probability = np.clip(self._probability('recovery', positions, (Ellipsis,)), 0, 1)
+            periods = np.full(positions.size, np.iinfo(np.int32).max, dtype=np.int64)
+            recovering = probability > 0
+            periods[recovering] = self.rng.geometric(probability[recovering])
+        elif self.infectious_period is None:
+            # the number of recovery draws until the first success
+            periods = self.rng.geometric(self.recovery_probability, size=positions.size) if self.recovery_probability > 0 else np.full(positions.size, np.iinfo(np.int32).max)
+        else:
+            periods = np.asarray(self.infectious_period(self.rng, positions.size))
+        steps = self._SIR_length + periods - 1
+
+        # one bucket per step, filled with a single sort
+        order = np.argsort(steps, kind='stable')
+        unique_steps, starts = np.unique(steps[order], return_index=True)
+        for step, bucket in zip(unique_steps, np.split(positions[order], starts[1:])):
+            self._recoveries.setdefault(int(step), []).append(bucket)
+
+    def _applyScheduledRecoveries(self):
+        """Makes the people in the bucket of the current step recovered.
 
         Returns
         -------
-        infected : int
-            The comunnity's population that is infected.
+        new_recovered : int
+            The number of people that recovered in this step.
 
         """
 
-        # use a mask and sum it to see the number of infected people, designated as having a value equal to one
-        self.infected = np.sum((self.getSpace()) == 1)
+        if self._recoveries is None:
+            # the people infected by hand, or before the mode was set, are scheduled from now on
+            self._recoveries = {}
+            self._scheduleRecoveries(np.flatnonzero(self.space == 1))
 
-        return self.infected
+        buckets = self._recoveries.pop(self._SIR_length, [])
+        positions = np.concatenate(buckets) if buckets else np.zeros(0, dtype=np.intp)
 
-    def getRecovered(self):
-        """Calculates the number of recovered from the current state of the space,
-        updates such number and returns it.
+        # people that are no longer infected are skipped
+        positions = positions[self.space.reshape(-1)[positions] == 1]
+
+        return self._changeState((Ellipsis,), positions, 2)
+
+    def _probability(self, which, positions, region):
+        """Returns the infection or recovery probability of the people at the
+        given positions of a region of the space. Without a probability map it
+        is the same for everybody, otherwise it is multiplied by the factor of
+        each position, which is shared by every replicate of a batched space.
+        A probability given per member of a stacked space, as in a 
+        Metapopulation, is taken for the member of each position.
+
+        Parameters
+        ----------
+        which : str
+            'infection' or 'recovery'.
+        positions : numpy array
+            The flat positions inside the region.
+        region : tuple
+            The index of the region of the space.
 
         Returns
         -------
-        recovered : int
-            The comunnity's population that is recovered.
+        probability : float or numpy array
+            The probability, or one probability per position.
 
         """
 
-        # use a mask and sum it to see the number of recovered people, designated as having a value equal to two
-        self.recovered = np.sum((self.getSpace()) == 2)
+        probability = self.infection_probability if which == 'infection' else self.recovery_probability
+        rows, cols = self.space.shape[-2:]
+        height, width = (rows, cols) if len(region) == 1 else (region[1].stop - region[1].start, region[2].stop - region[2].start)
+
+        if np.ndim(probability) > 0:
+            first = region[0].start if isinstance(region[0], slice) else 0
+            probability = np.asarray(probability)[first + positions // (height * width)]
+        if self.probability_maps[which] is None:
+            return probability
+        values, table = self.probability_maps[which]
+
+        # the position in the map of every position in the region, in any replicate
+        if len(region) == 1:
+            cells = positions % (rows * cols)
+        else:
+            inside = positions % (height * width)
+            cells = (inside // width + region[1].start) * cols + inside % width + region[2].start
+
+        factors = values.reshape(-1)[cells]
+        if table is not None:
+            factors = table[factors]
+        return probability * factors
+
+    def _applySchedule(self, step, pulses=True):
+        """Sets the probabilities of the given step from the per step arrays of
+        the schedule, and immunises the fraction of susceptible people of its 
+        pulse. After the last change of the schedule its values are kept.
 
-        return self.recovered
+        Parameters
+        ----------
+        step : int
+            The step, which is the number of steps already simulated.
+        pulses : bool, optional
+            Whether the vaccination pulse of the step is applied.
 
+        """
 
-    # set methods
-    def setBaseInfectionProbability(self, probability):
-        """Sets the base infection probability.
+        if self._schedule is None:
+            return
+
+        last = self._schedule['infection_probability'].shape[0] - 1
+        index = min(step, last)
+        self.base_infection_probability = self._schedule['base_infection_probability'][index]
+        self.infection_probability = self._schedule['infection_probability'][index]
+        recovery_probability = self._schedule['recovery_probability'][index]
+        if self.recovery_mode == 'scheduled' and self.infectious_period is None and np.any(recovery_probability != self.recovery_probability):
+            # the recovery steps already drawn follow the old probability, so they are drawn again from this step
+            self._recoveries = None
+        self.recovery_probability = recovery_probability
+
+        if pulses and step <= last and np.any(self._schedule['vaccinate'][step] > 0):
+            self.immunise(self._schedule['vaccinate'][step])
+
+    def _changesPending(self):
+        """Returns whether the space can still change without infected people,
+        because the schedule has vaccination pulses after the steps already 
+        simulated, or the compartment model has transitions out of states that
+        are not infected.
+
+        """
+
+        if not self.model.settles:
+            return True
+        if self._schedule is None:
+            return False
+        return bool(np.any(self._schedule['vaccinate'][self._SIR_length - 1:] > 0))
+
+    def _transmissionTable(self):
+        """Returns the infection probability of a healthy person for every 
+        possible number k of infected neighbours, 1 - (1 - p)^k, where p is the
+        infection probability of a single contact.
+
+        Returns
+        -------
+        table : numpy array
+            The probabilities for k from 0 to the largest possible count of the
+            neighbourhood, 8 for the Moore one.
+
+        """
+
+        return 1 - (1 - self.infection_probability) ** np.arange(int(self.neighbourhood.total) + 1)
+
+    def _drawBelow(self, probability, size):
+        """Draws size random numbers in [0, 1) with the kind of draws set by
+        setRandomDraws, and tells which of them are below the probability.
 
         Parameters
         ----------
-        probability : float
-            The probability used as the base infection probability.
+        probability : float or numpy array
+            The probability, or one probability per draw.
+        size : int
+            The number of draws.
+
+        Returns
+        -------
+        below : numpy array
+            Boolean array which is True where the draw is below the probability.
 
         """
 
-        self.base_infection_probability = probability
+        if self.random_draws == 'integer':
+            # 32 random bits compared with the probability scaled to 2^32
+            draws = self.rng.integers(0, 2**32, size=size, dtype=np.uint32)
+            if np.ndim(probability) == 0:
+                return draws < int(round(probability * 2**32))
+            return draws < np.multiply(probability, 2**32)
 
-    def calculateInfectionProbability(self, r):
-        """Calculates the infection probability to be used to advance the 
-        simulation. To do so, it subtracts r from the base infection probability.
+        if self.random_draws == 'float32':
+            draws = self.rng.random(out=self._workBuffers()['draws32'].reshape(-1)[:size], dtype=np.float32)
+            return draws < np.asarray(probability, dtype=np.float32)
+
+        draws = self.rng.random(out=self._workBuffers()['draws'].reshape(-1)[:size])
+        return draws < probability
+
+    def _changeState(self, region, positions, state):
+        """Moves the people at the given positions of a region of the space to 
+        a new state, records it in the snapshots and schedules the recovery of
+        the newly infected people if needed.
 
         Parameters
         ----------
-        r : float
-            The amount to subtract from the probability.
+        region : tuple
+            The index of the region of the space being updated.
+        positions : numpy array
+            The flat positions inside the region.
+        state : int
+            The new state.
+
+        Returns
+        -------
+        changed : int or numpy array
+            The number of people that changed state, per replicate if the space 
+            is batched.
 
         """
 
-        self.infection_probability = self.base_infection_probability * (1 - r)
+        space = self.space[region]
+        index = np.unravel_index(positions, space.shape)
+        space[index] = state
+
+        if self.keep_snapshots:
+            self.snapshots.record(region, index, state, self._SIR_length)
+
+        if state == 1 and self.recovery_mode == 'scheduled' and self._recoveries is not None:
+            # the positions in the whole space
+            offsets = [0] * (space.ndim - 2) + [part.start for part in region[1:]] if len(region) > 1 else [0] * space.ndim
+            if isinstance(region[0], slice):
+                offsets[0] = region[0].start
+            self._scheduleRecoveries(np.ravel_multi_index([i + o for i, o in zip(index, offsets)], self.space.shape))
+
+        if space.ndim == 2:
+            return positions.size
+        replicates = space.shape[:-2]
+        changed = np.bincount(positions // (space.shape[-2] * space.shape[-1]), minlength=int(np.prod(replicates))).reshape(replicates)
+        if isinstance(region[0], slice):
+            # a region of some of the replicates, whose counts go to their place in the stack
+            counts, changed = changed, np.zeros(self.space.shape[:-2], dtype=changed.dtype)
+            changed[region[0]] = counts
+        return changed
+
+    def _activeRegions(self):
+        """Returns the parts of the space that can change in the next step, 
+        which are the boxes around the infected people of every replicate grown
+        by the radius of the neighbourhood. With periodic boundaries a box that
+        crosses an edge spans the whole axis, since it continues at the 
+        opposite edge. A batched space is updated in a single region around 
+        the boxes of all the replicates, or in one region per replicate with 
+        infected people when their boxes are far apart or most replicates have
+        none, whichever updates fewer positions counting region_cost for each
+        region. The whole space is used when active_region is False, and the
+        whole replicate when its box covers more than dense_fraction of it.
 
-    def setRecoveryProbability(self, probability):
-        """Sets the recovery probability.
+        Returns
+        -------
+        regions : list
+            The indices of the regions of the space. The index of a region of
+            a single replicate starts with a slice of the stack.
+
+        """
+
+        if isinstance(self.neighbourhood, Network):
+            return [(Ellipsis,)]
+        if not self.active_region:
+            return [self._occupiedRegion()]
+
+        if self._active_box is None:
+            self._active_box = self._findInfectedBox((Ellipsis,))
+
+        boxes = self._active_box.reshape(-1, 4)
+        infected = np.flatnonzero(boxes[:, 0] < boxes[:, 1])
+        if infected.size == 0:
+            # nobody is infected, so nothing can change
+            return [(Ellipsis, slice(0, 0), slice(0, 0))]
+
+        rows, cols = self.space.shape[-2:]
+        radius_rows, radius_cols = self.neighbourhood.radius
+        grown = boxes[infected] + np.array([-radius_rows, radius_rows, -radius_cols, radius_cols])
+        if self.neighbourhood.boundary == 'periodic':
+            grown[(grown[:, 0] < 0) | (grown[:, 1] > rows), :2] = (0, rows)
+            grown[(grown[:, 2] < 0) | (grown[:, 3] > cols), 2:] = (0, cols)
+        grown = np.clip(grown, 0, [rows, rows, cols, cols])
+        areas = (grown[:, 1] - grown[:, 0]) * (grown[:, 3] - grown[:, 2])
+
+        # the box around the infected people of every replicate, updated in all of them
+        top, bottom, left, right = int(grown[:, 0].min()), int(grown[:, 1].max()), int(grown[:, 2].min()), int(grown[:, 3].max())
+        single = (bottom - top) * (right - left) * boxes.shape[0]
+        if self.space.ndim != 3 or single <= np.sum(areas) + infected.size * self.region_cost:
+            if (bottom - top) * (right - left) > self.dense_fraction * rows * cols:
+                return [self._occupiedRegion()]
+            return [(Ellipsis, slice(top, bottom), slice(left, right))]
+
+        # one region per replicate with infected people, the whole replicate if its box is dense
+        occupied = self._occupiedRegion()
+        whole = occupied[1:] if len(occupied) > 1 else (slice(0, rows), slice(0, cols))
+        regions = []
+        for replicate, (top, bottom, left, right), area in zip(infected.tolist(), grown.tolist(), areas):
+            if area > self.dense_fraction * rows * cols:
+                regions.append((slice(replicate, replicate + 1),) + whole)
+            else:
+                regions.append((slice(replicate, replicate + 1), slice(top, bottom), slice(left, right)))
+        return regions
+
+    def _occupiedRegion(self):
+        """Returns the smallest region of the space that holds every occupied
+        position, so the empty margins are skipped. The whole space is used 
+        with periodic and reflecting boundaries, which need the opposite edges
+        or the mirrored rows and columns of the margins.
+
+        Returns
+        -------
+        region : tuple
+            The index of the region of the space.
+
+        """
+
+        if self.occupancy is None or self.neighbourhood.boundary in ('periodic', 'reflect'):
+            return (Ellipsis,)
+
+        box = getattr(self, '_occupied_box', None)
+        if box is None or box[0] is not self.occupancy:
+            occupied = self.occupancy.reshape((-1,) + self.occupancy.shape[-2:])
+            rows = np.flatnonzero(np.any(occupied, axis=(0, 2)))
+            cols = np.flatnonzero(np.any(occupied, axis=(0, 1)))
+            if rows.size == 0:
+                region = (Ellipsis, slice(0, 0), slice(0, 0))
+            else:
+                region = (Ellipsis, slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+            box = self._occupied_box = (self.occupancy, region)
+        return box[1]
+
+    def _applyOccupancy(self):
+        """Writes the EMPTY code at the empty positions of the space, in every
+        replicate if it is batched.
+
+        """
+
+        if self.occupancy is not None:
+            self.space[np.broadcast_to(~self.occupancy, self.space.shape)] = self.EMPTY
+
+    def _updateActiveBox(self, regions):
+        """Finds the box around the infected people of every replicate after a
+        step. Only the updated regions are searched, and a dense step with a 
+        large fraction of infected people skips the search, keeping the whole 
+        space active.
 
         Parameters
         ----------
-        probability : float
-            The probability used as the recovery probability.
+        regions : list
+            The indices of the regions of the space updated by the step.
 
         """
 
-        self.recovery_probability = probability
+        if not self.active_region or isinstance(self.neighbourhood, Network):
+            return
 
+        boxes = np.zeros(self.space.shape[:-2] + (4,), dtype=np.int64)
+        if regions == [(Ellipsis,)] and np.sum(self.infected) > self.dense_fraction * self.space.size:
+            boxes[:] = (0, self.space.shape[-2], 0, self.space.shape[-1])
+        else:
+            # the replicates outside of the regions have no infected people
+            for region in regions:
+                boxes[region[0]] = self._findInfectedBox(region)
+        self._active_box = boxes
 
-class Simulator():
-    """ 
-    A class used perform multiple simulations on several different communities
-    and store results in an organized manner.
+    def _findInfectedBox(self, region):
+        """Finds the smallest box that contains every infected person inside the
+        given region of the space, for each replicate if the space is batched.
 
+        Parameters
+        ----------
+        region : tuple
+            The index of the region of the space to search.
 
-    Attributes
-    ----------
-    communitiesDict : dict
-        A python dictionary where the keys are the communities' names, and 
-        the values are Community's instances. These are the communities
-        where the simulations are going to be run with.
-    
-    resultsDict : dict
-        A python dictionary where the keys are the communities' names, and
-        the values are the dictionaries containing the results of all the
-        different simulations. These result dictionaries have two keys:
-        'max_infected_array' which is a numpy array with the peak number
-        of infections of every single simulation run with that Community, 
-        and 'total_infected_array' which is also a numpy array with the 
-        total number of people that are infectios or where infections at 
-        some point during the simulated time.
-    
+        Returns
+        -------
+        boxes : numpy array
+            The first and last plus one row and column of the box along the 
+            last axis, with one box per replicate of the region. A box without
+            infected people is all zeros.
 
-    Methods
-    -------
-    simulate(self, numberOfSimulations, simulationSteps, initiallyInfected=1, plot=False):
-        Perfomrs the inicated number of simulations throughout all the communities 
-        in the dictionary of communities. 
+        """
 
-    """
+        space = self.space[region]
+        boxes = np.zeros(space.shape[:-2] + (4,), dtype=np.int64)
+        if space.size == 0:
+            return boxes
+        infected = np.equal(space, 1, out=self._workBuffers(space.shape)['mask'])
+
+        # the first and last rows and columns with infected people, in every replicate
+        rows = np.any(infected, axis=-1).reshape(-1, space.shape[-2])
+        cols = np.any(infected, axis=-2).reshape(-1, space.shape[-1])
+        flat_boxes = boxes.reshape(-1, 4)
+        flat_boxes[:, 0] = np.argmax(rows, axis=1)
+        flat_boxes[:, 1] = space.shape[-2] - np.argmax(rows[:, ::-1], axis=1)
+        flat_boxes[:, 2] = np.argmax(cols, axis=1)
+        flat_boxes[:, 3] = space.shape[-1] - np.argmax(cols[:, ::-1], axis=1)
+
+        # move the boxes back to the coordinates of the whole space
+        if len(region) > 1:
+            flat_boxes += (region[1].start, region[1].start, region[2].start, region[2].start)
+        flat_boxes[~np.any(rows, axis=1)] = 0
+        return boxes
+
+    def _countInfectedNeighbours(self, region=None, table=None):
+        """Counts how many infected neighbours every position has, writing into 
+        the work buffers so that no new arrays are created. Positions beyond 
+        the edges of the space follow the boundary of the neighbourhood, and
+        positions outside of the given region count as healthy.
+
+        Parameters
+        ----------
+        region : tuple, optional
+            The index of the region of the space to use. By default the whole
+            space is used.
+        table : numpy array, optional
+            The uint8 lookup table, indexed by state code, with 1 for the 
+            infectious states. By default only state 1 is infectious.
+
+        Returns
+        -------
+        count : numpy array
+            An array of the type of the neighbourhood, uint8 for the Moore one,
+            with the same shape as the region, which is overwritten the next 
+            time this method is called.
 
-    def __init__(self, communitiesDict):
         """
+
+        if region is None:
+            region = (Ellipsis,)
+        space = self.space[region]
+        buffers = self._workBuffers(space.shape)
+
+        # the infected mask inside the padded buffer
+        radius_rows, radius_cols = self.neighbourhood.radius
+        padded = buffers['padded']
+        rows, cols = padded.shape[-2:]
+        inside = padded[..., radius_rows:rows - radius_rows, radius_cols:cols - radius_cols]
+        if table is None:
+            np.equal(space, 1, out=inside)
+        else:
+            np.take(table, space, out=inside)
+
+        if isinstance(self.neighbourhood, Network):
+            return self.neighbourhood.count(padded, buffers['count'])
+
+        # the halo follows the boundary at the edges of the space that the region reaches, or the rows beyond a band
+        if len(region) == 1:
+            edges = (True, True, True, True)
+        else:
+            edges = (region[1].start == 0, region[1].stop == self.space.shape[-2], 
+                     region[2].start == 0, region[2].stop == self.space.shape[-1])
+        self.neighbourhood.fillHalo(padded, edges, self._halo_rows)
+
+        return self.neighbourhood.count(padded, buffers['count'])
+
+    def _workBuffers(self, shape=None):
+        """Returns the arrays reused by every step. They are allocated once with
+        the size of the whole space, and smaller regions get contiguous views of
+        their beginning.
+
         Parameters
         ----------
-        communitiesDict : dict
-            A python dictionary where the keys are the communities' names, and 
-            the values are Community's instances. These are the communities
-            where the simulations are going to be run with.
+        shape : tuple, optional
+            The shape of the region being updated. By default the shape of the
+            whole space is used.
+
+        Returns
+        -------
+        buffers : dict
+            The infected mask with the halo of the neighbourhood, the neighbour
+            counts, two boolean masks and the random draws in float64 and float32.
 
         """
 
-        # assign the dictionary of communites 
-        self.communitiesDict = communitiesDict
+        # a space stored in a file is updated one band at a time, so the buffers only hold the largest band
+        full = self.space.shape
+        if self.band_rows is not None:
+            full = (max(bottom - top for top, bottom in self._bands()), full[-1])
+        if shape is None:
+            shape = full
+        radius_rows, radius_cols = self.neighbourhood.radius
+        padded_shape = shape[:-2] + (shape[-2] + 2 * radius_rows, shape[-1] + 2 * radius_cols)
+
+        storage = getattr(self, '_buffers', None)
+        key = (full, self.neighbourhood.radius, self.neighbourhood.dtype)
+        if storage is None or storage['key'] != key:
+            storage = {'key': key,
+                       'padded': np.zeros(int(np.prod(full[:-2] + (full[-2] + 2 * radius_rows, full[-1] + 2 * radius_cols))), dtype=np.uint8),
+                       'count': np.zeros(int(np.prod(full)), dtype=self.neighbourhood.dtype),
+                       'mask': np.zeros(int(np.prod(full)), dtype=bool),
+                       'other_mask': np.zeros(int(np.prod(full)), dtype=bool),
+                       'draws': np.zeros(int(np.prod(full))),
+                       'draws32': np.zeros(int(np.prod(full)), dtype=np.float32)}
+            self._buffers = storage
+
+        size = int(np.prod(shape))
+        buffers = {name: storage[name][:size].reshape(shape) for name in ('count', 'mask', 'other_mask', 'draws', 'draws32')}
+        buffers['padded'] = storage['padded'][:int(np.prod(padded_shape))].reshape(padded_shape)
+
+        return buffers
+
+    def __getstate__(self):
+        """Leaves the work buffers out when pickling, for example to send the
+        community to a worker process, since they are recreated on the first step.
+        The blank space of a copy made by _blankCopy is sent as its shape.
 
-        # create the dictionary of results, and populate it.
-        self.resultsDict = {}
+        """
 
-        for name in communitiesDict.keys():
-            self.resultsDict[name] = {'max_infected_array': np.zeros(0),
-                                      'total_infected_array': np.zeros(0)}
+        state = self.__dict__.copy()
+        state.pop('_buffers', None)
+        if self.space.ndim > 0 and not any(self.space.strides):
+            state['space'] = None
+            state['_blank_space'] = (self.space.shape, self.space.dtype.str)
+        return state
 
-        # ADD AN AVERAGE SIR CURVE
+    def __setstate__(self, state):
+        """Restores a pickled community, with the blank space of a copy made by
+        _blankCopy if it had one.
 
+        """
 
-    def simulate(self, numberOfSimulations, simulationSteps, initiallyInfected=1, plot=False):
-        """Perfomrs the inicated number of simulations throughout all the 
-        communities in the dictionary of communities. 
+        blank = state.pop('_blank_space', None)
+        self.__dict__.update(state)
+        if blank is not None:
+            self.space = np.broadcast_to(np.zeros((), dtype=blank[1]), blank[0])
+
+    def _copySettings(self, source):
+        """Copies every setting of another community that this one also has, 
+        which are all of their attributes except the ones in SIMULATED_DATA.
+        The maps, schedule and neighbourhood are shared, as in _blankCopy.
 
         Parameters
         ----------
-        numberOfSimulations: int
-            The total number of simulations to be performed with each Community.
-        simulationSteps : int
-            The number of total steps in the simulations.
-        initiallyInfected : int, optional
-            The initial number of infected people in each simulation. The default
-            value is set to 1.
-        plot : bool, optional
-            Boolean to indicate if the SIR plots should be displayed. Defaul value
-            is set to False.
+        source : Community
+            The community whose settings are copied.
 
         """
 
-        # make a loop to go through all the communities.
+        settings = source._blankCopy().__dict__
+        self.__dict__.update({name: value for name, value in settings.items() 
+                              if name in self.__dict__ and name not in self.SIMULATED_DATA})
+
+    def _blankCopy(self):
+        """Returns a copy of the community that shares its settings, maps, 
+        schedule and neighbourhood, but none of its simulated data. Its space 
+        is a read-only view of a single zero with the shape of the space, so it
+        takes no memory, and resetSimulatedData gives the copy a space of its 
+        own before it is simulated.
+
+        Returns
+        -------
+        community : Community
+            The copy, of the same class as this community.
+
+        """
+
+        blank = copy.copy(self)
+        blank.__dict__.pop('_buffers', None)
+        blank.space = np.broadcast_to(np.zeros((), dtype=self.space.dtype), self.space.shape)
+        blank.probability_maps = dict(self.probability_maps)
+        blank.snapshots = blank._newSnapshots()
+        blank.SIR = np.zeros(self.space.shape[:-2] + (3, 1))
+        blank._active_box = None
+        blank._band_infected = None
+        blank._recoveries = None
+        return blank
+
+    def countStates(self):
+        """Counts the number of susceptible, infected and recovered people with
+        a single pass over the space, updates such numbers and returns them. This
+        is needed after changing the space by hand, since the simulation only 
+        keeps track of the people that change state. Before the first step, 
+        the first column of the SIR time series and the first snapshot follow
+        the changes too, while the snapshots of steps already simulated are 
+        not rewritten.
+
+        Returns
+        -------
+        counts : tuple
+            The number of susceptible, infected and recovered people.
+
+        """
+
+        counts = self._histogram()
+        SIR = counts @ self.model.summary[:counts.shape[-1]]
+        self.susceptible = SIR[..., 0]
+        self.infected = SIR[..., 1]
+        self.recovered = SIR[..., 2]
+        self.immunised = counts[..., self.model.immunised]
+
+        # the space may have been changed by hand, so the box around the infected people and the recoveries are found again
+        self._active_box = None
+        self._band_infected = None
+        self._recoveries = None
+
+        if self._SIR_length == 1:
+            # nothing was simulated yet, so the first step is the changed space
+            self.SIR[..., 0] = np.stack([self.susceptible, self.infected, self.recovered], axis=-1)
+            if self.keep_snapshots:
+                self.snapshots = self._newSnapshots()
+
+        return self.susceptible, self.infected, self.recovered
+
+    def _histogram(self):
+        """Counts the people in each state with a single pass over the space.
+
+        Returns
+        -------
+        counts : numpy array
+            The number of people in each state of the compartment model, 
+            followed by the immunised ones, along the last axis, with one row
+            per replicate if the space is batched. For the SIR model these are
+            the susceptible, infected, recovered and immunised people.
+
+        """
+
+        states = self.model.immunised + 1
+        space = self.getSpace()
+        if self.band_rows is not None:
+            # the space is in a file, so it is read one band at a time
+            replicates = [[space[top:bottom].reshape(-1) for top, bottom in self._bands()]]
+        else:
+            replicates = [[row] for row in space.reshape(-1, space.shape[-2] * space.shape[-1])]
+
+        # each state is counted in chunks of the uint8 space, so no copy of the whole space is made
+        counts = np.zeros((len(replicates), states), dtype=np.int64)
+        equal = np.empty(self.CHUNK_SIZE, dtype=bool)
+        for replicate_counts, parts in zip(counts, replicates):
+            for part in parts:
+                for start in range(0, part.size, self.CHUNK_SIZE):
+                    chunk = part[start:start + self.CHUNK_SIZE]
+                    for state in range(states):
+                        replicate_counts[state] += np.count_nonzero(np.equal(chunk, state, out=equal[:chunk.size]))
+        return counts.reshape(space.shape[:-2] + (states,))
+
+    def _verifyCounts(self):
+        """Checks the counts kept by the simulation against a full count of the 
+        space, and raises a RuntimeError if they differ.
+
+        """
+
+        kept = np.stack([self.susceptible, self.infected, self.recovered, self.immunised], axis=-1)
+        counts = self._histogram()
+        counted = np.concatenate([counts @ self.model.summary[:counts.shape[-1]], counts[..., self.model.immunised:]], axis=-1)
+        if not np.array_equal(kept, counted):
+            raise RuntimeError('The kept counts {} differ from the counted ones {}.'.format(kept.tolist(), counted.tolist()))
+
+
+    # SIR time series
+    @property
+    def SIR(self):
+        """The SIR time series with shape 3 x (t+1). It is a view of the first
+        t+1 columns of a preallocated buffer, so it is only valid until the
+        simulated data is reset.
+
+        """
+        return self._SIR_buffer[..., :self._SIR_length]
+
+    @SIR.setter
+    def SIR(self, SIR):
+        self._SIR_buffer = np.array(SIR, dtype=float)
+        self._SIR_length = self._SIR_buffer.shape[-1]
+
+    def reserveSteps(self, steps):
+        """Makes sure that the SIR buffer has room for the given number of 
+        steps after the current one, so that they are added without copying.
+
+        Parameters
+        ----------
+        steps : int
+            The number of steps that are going to be simulated.
+
+        """
+
+        capacity = self._SIR_length + steps
+        if capacity > self._SIR_buffer.shape[-1]:
+            buffer = np.zeros(self._SIR_buffer.shape[:-1] + (capacity,))
+            buffer[..., :self._SIR_length] = self.SIR
+            self._SIR_buffer = buffer
+
+    def fillRemainingSteps(self, steps):
+        """Adds the given number of steps to the SIR time series without 
+        simulating them, repeating the current values. This is what happens once
+        nobody is infected, since then nobody can change state anymore.
+
+        Parameters
+        ----------
+        steps : int
+            The number of steps to add.
+
+        """
+
+        if steps <= 0:
+            return
+
+        self.reserveSteps(steps)
+        self._SIR_buffer[..., self._SIR_length:self._SIR_length + steps] = self._SIR_buffer[..., self._SIR_length - 1:self._SIR_length]
+        self._SIR_length += steps
+
+        # every remaining snapshot is the same as the current one
+        if self.keep_snapshots:
+            self.snapshots.extend(steps, self.getSpace())
+
+    def _resetSIR(self):
+        """Sets the SIR time series back to a single column of zeros, keeping
+        the buffer if it already has the right shape.
+
+        """
+
+        shape = self.space.shape[:-2] + (3,)
+        if getattr(self, '_SIR_buffer', None) is None or self._SIR_buffer.shape[:-1] != shape:
+            self._SIR_buffer = np.zeros(shape + (1,))
+        self._SIR_buffer[..., 0] = 0
+        self._SIR_length = 1
+
+    def _appendSIR(self, SIR_t):
+        """Adds a column to the SIR time series. When the buffer is full, its 
+        capacity is doubled, so open-ended stepping is amortised O(1) per step.
+
+        """
+
+        if self._SIR_length == self._SIR_buffer.shape[-1]:
+            self.reserveSteps(self._SIR_length)
+        self._SIR_buffer[..., self._SIR_length] = SIR_t
+        self._SIR_length += 1
+
+
+    # get methods
+    def getSnapshot(self, step):
+        """Returns the 2D numpy array representing the population at the given
+        step of the simulation, rebuilt from the snapshots.
+
+        Parameters
+        ----------
+        step : int
+            The step of the simulation, negative values count from the end.
+
+        Returns
+        -------
+        space : numpy 2D array
+            The state of the community at that step.
+
+        """
+
+        return self.snapshots[step]
+
+    def getSpace(self):
+        """ Returns the 2D numpy array representing the population.
+
+        Returns
+        -------
+        space : numpy 2D array
+            The current state of the community, as an array of uint8.
+
+        """
+        return self.space
+
+    def getName(self):
+        """Returns the name of the community.
+
+        Returns
+        -------
+        name : str
+            The comunnity's name.
+
+        """
+
+        return self.name
+
+    def getPopulation(self):
+        """Returns the size of the population.
+
+        Returns
+        -------
+        population : int
+            The comunnity's population.
+
+        """
+
+        return self.population
+
+    def getSusceptible(self):
+        """Calculates the number of susceptible from the current state of the space,
+        updates such number and returns it.
+
+        Returns
+        -------
+        susceptible : int
+            The comunnity's population that is susceptible.
+
+        """
+
+        # use a mask and sum it to see the number of healthy people, designated as having a value equal to zero
+        self.susceptible = np.sum((self.getSpace()) == 0, axis=(-2, -1))
+
+        return self.susceptible
+
+    def getInfected(self):
+        """Calculates the number of infected from the current state of the space,
+        updates such number and returns it.
+
+        Returns
+        -------
+        infected : int
+            The comunnity's population that is infected.
+
+        """
+
+        # use a mask and sum it to see the number of infected people, designated as having a value equal to one
+        self.infected = np.sum((self.getSpace()) == 1, axis=(-2, -1))
+
+        return self.infected
+
+    def getRecovered(self):
+        """Calculates the number of recovered from the current state of the space,
+        updates such number and returns it.
+
+        Returns
+        -------
+        recovered : int
+            The comunnity's population that is recovered.
+
+        """
+
+        # use a mask and sum it to see the number of recovered people, designated as having a value equal to two
+        self.recovered = np.sum((self.getSpace()) == 2, axis=(-2, -1))
+
+        return self.recovered
+
+
+    # set methods
+    def setBaseInfectionProbability(self, probability):
+        """Sets the base infection probability.
+
+        Parameters
+        ----------
+        probability : float
+            The probability used as the base infection probability.
+
+        """
+
+        self.base_infection_probability = probability
+
+    def calculateInfectionProbability(self, r):
+        """Calculates the infection probability to be used to advance the 
+        simulation. To do so, it subtracts r from the base infection probability.
+
+        Parameters
+        ----------
+        r : float
+            The amount to subtract from the probability.
+
+        """
+
+        self.infection_probability = self.base_infection_probability * (1 - r)
+
+    def setSnapshotPolicy(self, policy, value=None):
+        """Sets which snapshots are recorded from the next simulation on, and 
+        clears the current ones.
+
+        Parameters
+        ----------
+        policy : str
+            'all' keeps every step, encoded as the step each person changed 
+            state. 'off' keeps none. 'every' keeps a copy of every value-th step.
+            'last' keeps copies of the last value steps in a ring buffer. 'steps'
+            keeps copies of the steps in the list given as value.
+        value : int or list, optional
+            The value needed by the 'every', 'last' and 'steps' policies.
+
+        """
+
+        if policy not in ('all', 'off', 'every', 'last', 'steps'):
+            raise ValueError('Unknown snapshot policy {!r}.'.format(policy))
+        if policy in ('every', 'last', 'steps') and value is None:
+            raise ValueError('The snapshot policy {!r} needs a value.'.format(policy))
+        if policy != 'off' and self.band_rows is not None:
+            raise ValueError('No snapshots are recorded of a space stored in a file.')
+
+        self.snapshot_policy = (policy, value)
+        self.keep_snapshots = policy != 'off'
+        self.snapshots = self._newSnapshots()
+
+    def _newSnapshots(self):
+        """Returns an empty container for the snapshots, following the 
+        snapshot policy.
+
+        """
+
+        policy, value = self.snapshot_policy
+        if policy == 'every':
+            return SnapshotSample(every=value)
+        if policy == 'last':
+            return SnapshotSample(last=value)
+        if policy == 'steps':
+            return SnapshotSample(steps=value)
+        if not self.model.monotone:
+            # people can go back to a previous state, so every step is copied
+            return SnapshotSample(every=1)
+        return SnapshotHistory()
+
+    def setRandomDraws(self, kind):
+        """Sets the kind of random numbers drawn in the transitions. Float32 
+        and integer draws halve the memory traffic of the random numbers.
+
+        Parameters
+        ----------
+        kind : str
+            'float64' draws doubles, 'float32' draws singles, and 'integer' 
+            draws 32 random bits that are compared with the probability scaled 
+            to 2^32.
+
+        """
+
+        if kind not in ('float64', 'float32', 'integer'):
+            raise ValueError('Unknown kind of random draws {!r}.'.format(kind))
+
+        self.random_draws = kind
+
+    def setCompartmentModel(self, model):
+        """Sets the compartments and the transitions between them, and clears
+        the snapshots. The SIR model, which is the default one, has its own 
+        faster step, while any other model is performed by a table driven step 
+        over the whole space, see CompartmentModel. The scheduled recovery mode
+        only applies to the SIR model.
+
+        Parameters
+        ----------
+        model : CompartmentModel
+            The compartment model.
+
+        """
+
+        self.model = model
+        self.snapshots = self._newSnapshots()
+
+    def getCompartment(self, state):
+        """Counts the people in a state of the compartment model.
+
+        Parameters
+        ----------
+        state : str
+            The name of the state, or 'immunised'.
+
+        Returns
+        -------
+        count : int or numpy array
+            The number of people in that state, per replicate if the space is
+            batched.
+
+        """
+
+        code = self.model.immunised if state == 'immunised' else self.model.states.index(state)
+        return np.count_nonzero(self.getSpace() == code, axis=(-2, -1))
+
+    def setTransmissionMode(self, mode):
+        """Sets how the number of infected neighbours affects the infection 
+        probability. With 'any', a healthy person with at least one infected 
+        neighbour is infected with infection_probability. With 'per_contact',
+        every infected neighbour transmits independently with 
+        infection_probability, so a person with k infected neighbours is 
+        infected with probability 1 - (1 - infection_probability)^k, looked 
+        up from a table.
+
+        Parameters
+        ----------
+        mode : str
+            'any' or 'per_contact'.
+
+        """
+
+        if mode not in ('any', 'per_contact'):
+            raise ValueError('Unknown transmission mode {!r}.'.format(mode))
+
+        self.transmission = mode
+
+    def setNeighbourhood(self, kind='moore', radius=1, kernel=None, boundary='zero', method=None):
+        """Sets the neighbours of each person and what lies beyond the edges of
+        the space. The infected neighbours are counted with shifted additions 
+        for small neighbourhoods, and with box sums or FFT convolutions for 
+        large ones, see Neighbourhood.
+
+        Parameters
+        ----------
+        kind : str, optional
+            'von_neumann', 'moore' or 'circle', the neighbours at a Manhattan,
+            Chebyshev or Euclidean distance of at most radius. Ignored when a 
+            kernel is given. By default the Moore neighbourhood.
+
+        radius : int, optional
+            The radius of the neighbourhood. By default 1.
+
+        kernel : array-like, optional
+            2D array with odd sides and non-negative weights, where the weight
+            at each offset from the centre is the weight of that neighbour. 
+            With per contact transmission the weights count as contacts.
+
+        boundary : str, optional
+            'zero' if there is nobody beyond the edges, 'periodic' if the space
+            wraps around as a torus and 'reflect' if the edges mirror the space.
+
+        method : str, optional
+            'shift', 'box' or 'fft'. By default the fastest one is chosen.
+
+        """
+
+        neighbourhood = Neighbourhood(kind, radius, kernel, boundary, method)
+        if neighbourhood.boundary != 'zero' and any(r > n for r, n in zip(neighbourhood.radius, self.space.shape[-2:])):
+            raise ValueError('The neighbourhood is larger than the space.')
+
+        self.neighbourhood = neighbourhood
+
+    def setProbabilityMap(self, which, values, table=None):
+        """Sets a map of factors that multiply the infection or recovery 
+        probability at each position of the space, for example to make people
+        more susceptible in some area, or to apply social distancing inside a
+        mask. The map is shared by every replicate of an ensemble.
+
+        Parameters
+        ----------
+        which : str
+            'infection' or 'recovery'.
+
+        values : array-like
+            2D array with the shape of the space. Either the factors, which 
+            are stored as float32, or uint8 levels whose factors are looked up 
+            in the table. None removes the map.
+
+        table : array-like, optional
+            The factor of each level, needed for uint8 levels.
+
+        """
+
+        if which not in self.probability_maps:
+            raise ValueError('Unknown probability {!r}.'.format(which))
+
+        if values is None:
+            self.probability_maps[which] = None
+            return
+
+        values = np.asarray(values)
+        if values.shape != self.space.shape[-2:]:
+            raise ValueError('The map has shape {} instead of the shape of the space {}.'.format(values.shape, self.space.shape[-2:]))
+
+        if table is None:
+            values = values.astype(np.float32, copy=False)
+        else:
+            table = np.asarray(table, dtype=np.float64)
+            if values.dtype != np.uint8:
+                raise ValueError('The levels of a map with a lookup table must be uint8.')
+            if values.max() >= table.size:
+                raise ValueError('The map has levels without a factor in the table.')
+
+        self.probability_maps[which] = (values, table)
+
+    def setSchedule(self, schedule):
+        """Sets changes of the parameters at given steps of the simulations, 
+        which are precomputed into one array per parameter so that every step
+        only indexes them. A change keyed by step k applies from the transition
+        between steps k and k+1 on, until the next change. The probabilities 
+        before the first change are the ones of the community when the 
+        schedule is set, and they are restored by resetSimulatedData.
+
+        Parameters
+        ----------
+        schedule : dict
+            Dictionary keyed by step, whose values are dictionaries with any of
+            'base_infection_probability', 'r' (the reduction of the base 
+            infection probability, as in calculateInfectionProbability), 
+            'recovery_probability', and 'vaccinate' (the fraction of the 
+            susceptible people immunised at that step). Like the 
+            probabilities, the fraction can have one value per member of a
+            stacked space.
+            None removes the schedule. In the 'scheduled' recovery mode the 
+            recovery probability can only change with the default geometric
+            infectious period, and the recoveries of the people already 
+            infected are drawn again when it does.
+
+        """
+
+        if self._schedule is not None:
+            # the values at the start of the current schedule
+            self._applySchedule(0, pulses=False)
+
+        if schedule is None:
+            self.schedule = self._schedule = None
+            return
+
+        known = {'base_infection_probability', 'r', 'recovery_probability', 'vaccinate'}
+        for step, changes in schedule.items():
+            if int(step) != step or step < 0:
+                raise ValueError('The steps of the schedule must be non-negative integers.')
+            if not set(changes) <= known:
+                raise ValueError('Unknown parameters {} at step {}.'.format(sorted(set(changes) - known), step))
+            if 'recovery_probability' in changes and self.recovery_mode == 'scheduled' and self.infectious_period is not None:
+                raise ValueError('A custom infectious period does not follow the recovery probability of the schedule.')
+
+        # the probabilities may have one value per member of a stacked space, as in a Metapopulation
+        length = max(schedule, default=0) + 1
+        base = np.full((length,) + np.shape(self.base_infection_probability), self.base_infection_probability, dtype=np.float64)
+        infection = np.full((length,) + np.shape(self.infection_probability), self.infection_probability, dtype=np.float64)
+        recovery = np.full((length,) + np.shape(self.recovery_probability), self.recovery_probability, dtype=np.float64)
+        vaccinate = np.zeros((length,) + np.shape(self.infection_probability))
+
+        # every change holds from its step on, so the arrays are filled from the back of each change
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(base[0] != 0, 1 - infection[0] / base[0], 0)
+        for step in sorted(schedule):
+            changes = schedule[step]
+            if 'base_infection_probability' in changes:
+                base[step:] = changes['base_infection_probability']
+            if 'r' in changes:
+                r = changes['r']
+            if 'base_infection_probability' in changes or 'r' in changes:
+                infection[step:] = base[step] * (1 - r)
+            if 'recovery_probability' in changes:
+                recovery[step:] = changes['recovery_probability']
+            vaccinate[step] = changes.get('vaccinate', 0)
+
+        self.schedule = copy.deepcopy(schedule)
+        self._schedule = {'base_infection_probability': base, 
+                          'infection_probability': infection, 
+                          'recovery_probability': recovery, 
+                          'vaccinate': vaccinate}
+
+    def setRecoveryMode(self, mode, infectious_period=None):
+        """Sets how the recoveries are drawn. In the 'bernoulli' mode every 
+        infected person recovers with recovery_probability at every step. In 
+        the 'scheduled' mode the step where each person recovers is drawn once,
+        when the person is infected, and the recoveries of each step are taken
+        from a bucket. With the default geometric infectious period both modes
+        give the same distribution of outcomes.
+
+        Parameters
+        ----------
+        mode : str
+            'bernoulli' or 'scheduled'.
+        infectious_period : callable, optional
+            Only used by the 'scheduled' mode. A function of a numpy Generator
+            and a size that returns that many integers of at least 1: the number
+            of steps, counting the one where the person was infected, until the
+            person recovers. It has to be picklable to run in several processes.
+            By default a geometric number with recovery_probability is used.
+
+        """
+
+        if mode not in ('bernoulli', 'scheduled'):
+            raise ValueError('Unknown recovery mode {!r}.'.format(mode))
+        recovery_changes = self._schedule is not None and np.any(self._schedule['recovery_probability'] != self._schedule['recovery_probability'][0])
+        if mode == 'scheduled' and infectious_period is not None and recovery_changes:
+            raise ValueError('A custom infectious period does not follow the recovery probability of the schedule.')
+
+        self.recovery_mode = mode
+        self.infectious_period = infectious_period
+        self._recoveries = None
+
+    def setSeed(self, seed):
+        """Replaces the random number generator of the community by a new one
+        created from the given seed, so the next simulation can be reproduced.
+
+        Parameters
+        ----------
+        seed : int or SeedSequence
+            The seed of the random number generator.
+
+        """
+
+        self.rng = np.random.default_rng(seed)
+
+    def setOutOfCore(self, filename=None, band_rows=1024):
+        """Stores the space in a memory mapped file and steps it one band of
+        rows at a time, for spaces larger than the memory. Only a band and the
+        rows around it are in memory during a step, the counts and the SIR time
+        series are kept from the people that change state in each band, and 
+        bands far from the infected people are not read. It needs the SIR 
+        model with bernoulli recoveries, and no snapshots are recorded. Random
+        initially infected people are placed without listing the susceptible
+        ones and the immunisations are applied one band at a time, while the
+        other placements of the initially infected people still create masks
+        of the size of the space.
+
+        Parameters
+        ----------
+        filename : str, optional
+            The file that holds the space, which is overwritten. By default a
+            temporary file is used.
+        band_rows : int, optional
+            The number of rows of each band.
+
+        """
+
+        if self.space.ndim != 2 or isinstance(self.neighbourhood, Network):
+            raise ValueError('Only a single 2D space with a lattice neighbourhood can be stored in a file.')
+        if band_rows < 1:
+            raise ValueError('The bands must have at least one row.')
+
+        self.setSnapshotPolicy('off')
+        space = np.memmap(tempfile.TemporaryFile() if filename is None else filename, dtype=np.uint8, mode='w+', shape=self.space.shape)
+        for top in range(0, space.shape[0], band_rows):
+            space[top:top + band_rows] = self.space[top:top + band_rows]
+        space.flush()
+
+        self.space = space
+        self.band_rows = band_rows
+        self._buffers = None
+        self._band_infected = None
+
+    def setOccupancy(self, mask):
+        """Sets which positions of the space are occupied. The empty positions
+        are left out of the transitions, the counts and the population, and 
+        the steps skip the empty margins of the space. This resets the 
+        simulated data.
+
+        Parameters
+        ----------
+        mask : array-like
+            2D boolean array with the shape of the space, which is True where 
+            people live. None makes every position occupied.
+
+        """
+
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != self.space.shape[-2:]:
+                raise ValueError('The mask has shape {} instead of the shape of the space {}.'.format(mask.shape, self.space.shape[-2:]))
+
+        self.occupancy = mask
+        self.population = self.space.shape[-2] * self.space.shape[-1] if mask is None else int(np.count_nonzero(mask))
+        self.resetSimulatedData()
+
+    def setRecoveryProbability(self, probability):
+        """Sets the recovery probability.
+
+        Parameters
+        ----------
+        probability : float
+            The probability used as the recovery probability.
+
+        """
+
+        self.recovery_probability = probability
+
+
+class SnapshotHistory():
+    """ 
+    A class used to keep the snapshots of a simulation without copying the
+    space at every step. Since people only move forward through the states
+    (0 to 1 to 2, or 0 to 3), the whole history is given by the space at the first step
+    and the step where each person entered every later state. This takes a 
+    fixed amount of memory per person regardless of the number of steps, and
+    the space of any step is rebuilt when it is accessed. It behaves like a 
+    read-only list of numpy arrays.
+
+
+    Attributes
+    ----------
+    first : numpy array
+        The space at the first step, or None if nothing has been recorded.
+
+    entered : dict
+        A python dictionary where the keys are the states and the values are
+        int32 numpy arrays with the step where each person entered that state.
+
+
+    Methods
+    -------
+    start(space)
+        Starts the history from the given space, which is the first snapshot.
+
+    record(region, changed, state, step)
+        Records that the people in the changed mask entered a state at a step.
+
+    extend(steps, space)
+        Adds the given number of steps to the history.
+
+    select(index)
+        Returns the history of one replicate of a batched space.
+
+    """
+
+    # the step used for people that never entered a state
+    NEVER = np.iinfo(np.int32).max
+
+    def __init__(self):
+        self.first = None # the space at the first step
+        self.entered = {} # the step where each person entered each state
+        self.length = 0 # the number of snapshots
+
+    def start(self, space):
+        """Starts the history from the given space, which is the first snapshot.
+
+        Parameters
+        ----------
+        space : numpy array
+            The space at the first step, which is copied.
+
+        """
+
+        self.first = space.copy()
+        self.entered = {}
+        self.length = 1
+
+    def record(self, region, changed, state, step):
+        """Records that the people in the changed mask entered a state at a step.
+
+        Parameters
+        ----------
+        region : tuple
+            The index of the region of the space the mask refers to.
+        changed : numpy array or tuple
+            Boolean mask, or index arrays, of the people that changed state.
+        state : int
+            The state they entered.
+        step : int
+            The step of the simulation where it happened.
+
+        """
+
+        if state not in self.entered:
+            self.entered[state] = np.full(self.first.shape, self.NEVER, dtype=np.int32)
+        self.entered[state][region][changed] = step
+
+    def extend(self, steps, space=None):
+        """Adds the given number of steps to the history, whose changes must
+        have been recorded already.
+
+        Parameters
+        ----------
+        steps : int
+            The number of steps to add.
+        space : numpy array, optional
+            The current space, which is not needed by this class.
+
+        """
+
+        self.length += steps
+
+    def select(self, index):
+        """Returns the history of one replicate of a batched space.
+
+        Parameters
+        ----------
+        index : int
+            The index of the replicate along the first axis.
+
+        Returns
+        -------
+        history : SnapshotHistory
+            A new history with copies of the arrays of that replicate.
+
+        """
+
+        history = SnapshotHistory()
+        if self.first is not None:
+            history.first = self.first[index].copy()
+            history.entered = {state: entered[index].copy() for state, entered in self.entered.items()}
+        history.length = self.length
+        return history
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return [self[s] for s in range(*step.indices(self.length))]
+
+        if step < 0:
+            step += self.length
+        if not 0 <= step < self.length:
+            raise IndexError('snapshot index out of range')
+
+        # apply the states in order, so the latest state of each person is kept
+        space = self.first.copy()
+        for state in sorted(self.entered):
+            space[self.entered[state] <= step] = state
+        return space
+
+    def __iter__(self):
+        for step in range(self.length):
+            yield self[step]
+
+
+class SnapshotSample():
+    """ 
+    A class used to keep copies of the space at some of the steps of a 
+    simulation: every k-th step, the last N steps in a ring buffer, or a list
+    of steps. It is indexed by step like SnapshotHistory, but only the kept 
+    steps can be accessed.
+
+
+    Attributes
+    ----------
+    every : int
+        Keep every value-th step, or None.
+
+    last : int
+        Keep the last value steps, or None.
+
+    steps : set
+        Keep these steps, or None.
+
+
+    Methods
+    -------
+    start(space)
+        Starts the sample from the given space, which is the first snapshot.
+
+    record(region, changed, state, step)
+        Does nothing, since the copies are taken from the space.
+
+    extend(steps, space)
+        Adds the given number of steps, all with the given space.
+
+    keptSteps()
+        Returns the steps that can be accessed.
+
+    select(index)
+        Returns the sample of one replicate of a batched space.
+
+    """
+
+    def __init__(self, every=None, last=None, steps=None):
+        self.every = every # keep every value-th step
+        self.last = last # keep the last value steps
+        self.steps = None if steps is None else set(steps) # keep these steps
+        self.kept = {} # the copies of the kept steps, by step
+        self.ring = None # the ring buffer with the last steps
+        self.length = 0 # the number of steps
+
+    def start(self, space):
+        """Starts the sample from the given space, which is the first snapshot.
+
+        Parameters
+        ----------
+        space : numpy array
+            The space at the first step.
+
+        """
+
+        self.kept = {}
+        self.length = 0
+        if self.last is not None:
+            self.ring = np.zeros((self.last,) + space.shape, dtype=space.dtype)
+        self.extend(1, space)
+
+    def record(self, region, changed, state, step):
+        """Does nothing, since the copies are taken from the space at the end 
+        of every step.
+
+        """
+
+    def extend(self, steps, space):
+        """Adds the given number of steps, all of them with the given space.
+
+        Parameters
+        ----------
+        steps : int
+            The number of steps to add.
+        space : numpy array
+            The space at these steps.
+
+        """
+
+        new_steps = range(self.length, self.length + steps)
+        self.length += steps
+
+        if self.last is not None:
+            # only the last ones can stay in the ring buffer
+            for step in new_steps[-self.last:]:
+                self.ring[step % self.last] = space
+            return
+
+        if self.every is not None:
+            kept_steps = new_steps[(-new_steps.start) % self.every::self.every]
+        else:
+            kept_steps = [step for step in new_steps if step in self.steps]
+
+        # steps added together share a single copy
+        if len(kept_steps) > 0:
+            copy = space.copy()
+            for step in kept_steps:
+                self.kept[step] = copy
+
+    def select(self, index):
+        """Returns the sample of one replicate of a batched space.
+
+        Parameters
+        ----------
+        index : int
+            The index of the replicate along the first axis.
+
+        Returns
+        -------
+        sample : SnapshotSample
+            A new sample with copies of the arrays of that replicate.
+
+        """
+
+        sample = SnapshotSample(self.every, self.last, self.steps)
+        sample.length = self.length
+        if self.ring is not None:
+            sample.ring = self.ring[:, index].copy()
+
+        # steps that shared a copy keep sharing it
+        copies = {}
+        for step, space in self.kept.items():
+            if id(space) not in copies:
+                copies[id(space)] = space[index].copy()
+            sample.kept[step] = copies[id(space)]
+        return sample
+
+    def keptSteps(self):
+        """Returns the steps that can be accessed.
+
+        Returns
+        -------
+        steps : list
+            The kept steps in increasing order.
+
+        """
+
+        if self.last is not None:
+            return list(range(max(self.length - self.last, 0), self.length))
+        return sorted(self.kept)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            kept_steps = set(self.keptSteps())
+            return [self[s] for s in range(*step.indices(self.length)) if s in kept_steps]
+
+        if step < 0:
+            step += self.length
+
+        if self.last is not None and self.length - self.last <= step < self.length:
+            return self.ring[step % self.last].copy()
+        if self.last is None and step in self.kept:
+            return self.kept[step]
+        raise IndexError('step {} was not kept by the snapshot policy'.format(step))
+
+    def __iter__(self):
+        for step in self.keptSteps():
+            yield self[step]
+
+
+class SnapshotReplicate():
+    """ 
+    A class used to keep the snapshots of a single replicate of a batched 
+    space, following the snapshot policy of the container it wraps. The 
+    changes of the other replicates are left out, so the snapshots of one 
+    replicate of an Ensemble take the memory of a single simulation.
+
+
+    Attributes
+    ----------
+    snapshots : SnapshotHistory or SnapshotSample
+        The snapshots of the replicate.
+
+    index : int
+        The index of the replicate along the first axis.
+
+
+    Methods
+    -------
+    start(space)
+        Starts the snapshots from the replicate in the given space.
+
+    record(region, changed, state, step)
+        Records the changes of the replicate among the given ones.
+
+    extend(steps, space)
+        Adds the given number of steps to the snapshots.
+
+    select(index)
+        Returns the snapshots of the replicate.
+
+    """
+
+    def __init__(self, snapshots, index):
+        self.snapshots = snapshots # the snapshots of the replicate
+        self.index = index # the index of the replicate
+
+    def start(self, space):
+        """Starts the snapshots from the replicate in the given space.
+
+        Parameters
+        ----------
+        space : numpy array
+            The batched space at the first step.
+
+        """
+
+        self.snapshots.start(space[self.index])
+
+    def record(self, region, changed, state, step):
+        """Records which of the people that changed state belong to the 
+        replicate.
+
+        Parameters
+        ----------
+        region : tuple
+            The index of the region of the space the changes refer to.
+        changed : tuple
+            Index arrays of the people that changed state, with the replicate
+            first.
+        state : int
+            The state they entered.
+        step : int
+            The step of the simulation where it happened.
+
+        """
+
+        # a region of some of the replicates starts with a slice of the stack
+        first = region[0].start if isinstance(region[0], slice) else 0
+        kept = changed[0] + first == self.index
+        self.snapshots.record((Ellipsis,) + region[1:], tuple(part[kept] for part in changed[1:]), state, step)
+
+    def extend(self, steps, space=None):
+        """Adds the given number of steps to the snapshots.
+
+        Parameters
+        ----------
+        steps : int
+            The number of steps to add.
+        space : numpy array, optional
+            The current batched space.
+
+        """
+
+        self.snapshots.extend(steps, None if space is None else space[self.index])
+
+    def select(self, index):
+        """Returns the snapshots of the replicate, which are the only ones kept.
+
+        Parameters
+        ----------
+        index : int
+            The index of the replicate, which must be the one kept.
+
+        Returns
+        -------
+        snapshots : SnapshotHistory or SnapshotSample
+            The snapshots of the replicate.
+
+        """
+
+        if index != self.index:
+            raise ValueError('Only the snapshots of replicate {} were kept.'.format(self.index))
+        return self.snapshots
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __getitem__(self, step):
+        return self.snapshots[step]
+
+    def __iter__(self):
+        return iter(self.snapshots)
+
+
+class CompartmentModel():
+    """ 
+    A class used to describe the compartments of a disease and the transitions
+    between them, compiled into lookup tables indexed by the state code of 
+    each person. Transitions are either triggered by exposure to infectious 
+    neighbours, or happen with a probability at every step. A step of a 
+    community with a compartment model first performs the transitions 
+    triggered by exposure and then the other ones, as the SIR step does. Each
+    phase gathers the people that can change state with a single lookup, and
+    draws a single random number for each of them, which picks one of their 
+    competing transitions or none.
+
+    The first state is the susceptible one, and the people of the states in 
+    infected count as infected in the SIR time series, while the rest of them
+    count as recovered. The code after the last state is the immunised one.
+
+
+    Attributes
+    ----------
+    states : list
+        The names of the states, whose codes are their positions.
+
+    transitions : list
+        The (source, target, kind, probability) of every transition, where 
+        kind is 'exposure' or 'probability'.
+
+    infectious : list
+        The states that infect their neighbours.
+
+    infected : list
+        The states counted as infected.
+
+    seed : int
+        The code given to the initially infected people.
+
+    immunised : int
+        The code of the immunised people.
+
+    fast : bool
+        Whether the model is the SIR one, which has its own faster step.
+
+    monotone : bool
+        Whether every transition goes to a state with a larger code, so the
+        history of every person can be kept as the step it entered each state.
+
+    settles : bool
+        Whether nothing can change once nobody is infected.
+
+    """
+
+    EXPOSURE = 1
+    PROBABILITY = 2
+
+    def __init__(self, states, transitions, infectious, infected=None, seed=None):
+        """
+        Parameters
+        ----------
+        states : list
+            The names of the states, starting with the susceptible one.
+
+        transitions : list
+            Tuples (source, target, kind, probability). With kind 'exposure', 
+            the probability is the one of being infected by infectious 
+            neighbours, as with the infection probability of a community, and
+            with kind 'probability' it is the probability of the transition 
+            at every step. A probability of None uses the infection or the 
+            recovery probability of the community, so r, schedules and 
+            probability maps apply to it.
+
+        infectious : list
+            The states that infect their neighbours.
+
+        infected : list, optional
+            The states counted as infected. By default the infectious states
+            and the states with a transition into one of them.
+
+        seed : str, optional
+            The state of the initially infected people. By default the first
+            of the infected states.
+        """
+
+        states = list(states)
+        codes = {state: code for code, state in enumerate(states)}
+        if len(codes) != len(states) or len(states) < 2 or len(states) > 254:
+            raise ValueError('The states must be between 2 and 254 different names.')
+        for source, target, kind, probability in transitions:
+            if source not in codes or target not in codes or source == target:
+                raise ValueError('Unknown or repeated states in the transition {} to {}.'.format(source, target))
+            if kind not in ('exposure', 'probability'):
+                raise ValueError('Unknown kind of transition {!r}.'.format(kind))
+
+        if infected is None:
+            infected = [state for state in states if state in infectious or 
+                        any(source == state and target in infectious for source, target, _, _ in transitions)]
+            infected = [state for state in infected if state != states[0]]
+        unknown = [state for state in list(infectious) + list(infected) + ([] if seed is None else [seed]) if state not in codes]
+        if unknown:
+            raise ValueError('Unknown states {}.'.format(unknown))
+        if len(infected) == 0:
+            raise ValueError('The model must have at least one infected state.')
+
+        self.states = states
+        self.transitions = [tuple(transition) for transition in transitions]
+        self.infectious = list(infectious)
+        self.infected = list(infected)
+        self.seed = codes[self.infected[0] if seed is None else seed]
+        self.immunised = len(states)
+
+        # one row per code, with the competing transitions of that state
+        outgoing = [[transition for transition in self.transitions if transition[0] == state] for state in states]
+        width = max(len(row) for row in outgoing)
+        self.kinds = np.zeros((256, width), dtype=np.uint8)
+        self.probabilities = np.zeros((256, width))
+        self.targets = np.tile(np.arange(256, dtype=np.uint8)[:, np.newaxis], (1, width + 1))
+        for code, row in enumerate(outgoing):
+            for column, (source, target, kind, probability) in enumerate(row):
+                self.kinds[code, column] = self.EXPOSURE if kind == 'exposure' else self.PROBABILITY
+                self.probabilities[code, column] = np.nan if probability is None else probability
+                self.targets[code, column] = codes[target]
+
+        # the lookups of a step, indexed by the state code of each person
+        self.infectious_table = np.isin(np.arange(256), [codes[state] for state in self.infectious]).astype(np.uint8)
+        self.exposure_table = np.any(self.kinds == self.EXPOSURE, axis=1)
+        self.probability_table = np.any(self.kinds == self.PROBABILITY, axis=1)
+
+        # how each code is counted in the SIR time series, the immunised people are left out
+        self.summary = np.zeros((256, 3), dtype=np.int64)
+        self.summary[:len(states), 2] = 1
+        self.summary[0] = (1, 0, 0)
+        for state in self.infected:
+            self.summary[codes[state]] = (0, 1, 0)
+
+        self.fast = (states == ['S', 'I', 'R'] and self.infectious == ['I'] and self.infected == ['I'] and self.seed == 1 and
+                     sorted(self.transitions) == [('I', 'R', 'probability', None), ('S', 'I', 'exposure', None)])
+        self.monotone = all(codes[target] > codes[source] for source, target, _, _ in self.transitions)
+        self.settles = all(kind == 'exposure' or source in self.infected for source, _, kind, _ in self.transitions)
+
+
+# the default model of every community, which has its own faster step
+SIR = CompartmentModel(['S', 'I', 'R'], [('S', 'I', 'exposure', None), ('I', 'R', 'probability', None)], ['I'])
+
+
+class Neighbourhood():
+    """ 
+    A class used to count the infected neighbours of every person, given the
+    weight of each neighbour around a person and what lies beyond the edges
+    of the space. The counts are made with the fastest method for the kernel:
+    shifted additions for small kernels, box sums for rectangles of equal 
+    weights and FFT convolutions for the remaining large ones.
+
+
+    Attributes
+    ----------
+    kernel : numpy array
+        2D array with odd sides and the weight of the neighbour at each offset 
+        from its centre, which is the person itself.
+
+    radius : tuple
+        The number of rows and columns of the kernel at each side of its centre.
+
+    boundary : str
+        'zero' if there is nobody beyond the edges, 'periodic' if the space 
+        wraps around as a torus and 'reflect' if the edges mirror the space.
+
+    method : str
+        'shift', 'box' or 'fft', the method used to count.
+
+    dtype : numpy dtype
+        The type of the counts, uint8 when they fit in it.
+
+    total : float
+        The largest possible count, with every neighbour infected.
+
+
+    Methods
+    -------
+    count(padded, out)
+        Counts the infected neighbours from the infected mask surrounded by the
+        halo given by radius.
+
+    fillHalo(padded, edges)
+        Fills the halo of the padded infected mask following the boundary.
+
+    """
+
+    KINDS = ('von_neumann', 'moore', 'circle')
+    BOUNDARIES = ('zero', 'periodic', 'reflect')
+
+    def __init__(self, kind='moore', radius=1, kernel=None, boundary='zero', method=None):
+        """
+        Parameters
+        ----------
+        kind : str, optional
+            'von_neumann', 'moore' or 'circle', the neighbours at a Manhattan,
+            Chebyshev or Euclidean distance of at most radius. Ignored when a 
+            kernel is given. By default the Moore neighbourhood.
+
+        radius : int, optional
+            The radius of the neighbourhood. By default 1.
+
+        kernel : array-like, optional
+            2D array with odd sides and non-negative weights, where the weight
+            at each offset from the centre is the weight of that neighbour.
+
+        boundary : str, optional
+            'zero', 'periodic' or 'reflect'. By default there is nobody beyond
+            the edges.
+
+        method : str, optional
+            'shift', 'box' or 'fft'. By default the fastest one is chosen.
+        """
+
+        if kernel is None:
+            if kind not in self.KINDS:
+                raise ValueError('Unknown neighbourhood {!r}.'.format(kind))
+            if int(radius) != radius or radius < 1:
+                raise ValueError('The radius must be a positive integer.')
+            rows, cols = np.ogrid[-radius:radius + 1, -radius:radius + 1]
+            if kind == 'von_neumann':
+                kernel = np.abs(rows) + np.abs(cols) <= radius
+            elif kind == 'moore':
+                kernel = np.maximum(np.abs(rows), np.abs(cols)) <= radius
+            else:
+                kernel = rows ** 2 + cols ** 2 <= radius ** 2
+            kernel = kernel.astype(np.uint8)
+            kernel[radius, radius] = 0
+
+        kernel = np.array(kernel)
+        if kernel.ndim != 2 or kernel.shape[0] % 2 == 0 or kernel.shape[1] % 2 == 0:
+            raise ValueError('The kernel must be a 2D array with odd sides.')
+        if np.any(kernel < 0):
+            raise ValueError('The weights of the kernel must be non-negative.')
+        if boundary not in self.BOUNDARIES:
+            raise ValueError('Unknown boundary {!r}.'.format(boundary))
+
+        self.kernel = kernel
+        self.radius = (kernel.shape[0] // 2, kernel.shape[1] // 2)
+        self.boundary = boundary
+        self.total = kernel.sum()
+
+        # integer weights give exact integer counts, in the smallest type that holds them
+        if np.issubdtype(kernel.dtype, np.integer) or np.issubdtype(kernel.dtype, np.bool_):
+            self.dtype = np.dtype(np.uint8) if self.total <= np.iinfo(np.uint8).max else np.dtype(np.int64)
+        else:
+            self.dtype = np.dtype(np.float64)
+
+        # the offsets and weights of the neighbours for the shifted additions
+        self._offsets = [(row, col, kernel[row, col]) for row, col in zip(*np.nonzero(kernel))]
+
+        # a box sum needs every weight but the centre's to be equal
+        centre = kernel[self.radius]
+        outer = kernel.astype(np.float64)
+        outer[self.radius] = outer[0, 0]
+        box = np.all(outer == outer[0, 0]) and outer[0, 0] > 0
+
+        # shifted additions of uint8 masks are cheap up to about 160 neighbours, and heavier ones when they need casting
+        if method is None:
+            unit = self.dtype == np.uint8 and all(weight == 1 for row, col, weight in self._offsets)
+            if len(self._offsets) <= (160 if unit else 40):
+                method = 'shift'
+            elif box:
+                method = 'box'
+            else:
+                method = 'fft'
+        elif method not in ('shift', 'box', 'fft'):
+            raise ValueError('Unknown method {!r}.'.format(method))
+        elif method == 'box' and not box:
+            raise ValueError('The box method needs every weight but the centre to be equal.')
+        self.method = method
+        self._box = (outer[0, 0], outer[0, 0] - centre) # the weight of the box and what the centre lacks
+        self._kernel_fft = (None, None) # the transform of the kernel for the last padded shape
+
+    def __getstate__(self):
+        """Leaves the transform of the kernel out when pickling.
+
+        """
+
+        state = self.__dict__.copy()
+        state['_kernel_fft'] = (None, None)
+        return state
+
+    def fillHalo(self, padded, edges, halo_rows=None):
+        """Fills the halo of the padded infected mask. Beyond the edges of the
+        space it follows the boundary, and beyond the edges of a region inside 
+        the space it is empty, since there are no infected people there, 
+        unless the rows beyond the region are given.
+
+        Parameters
+        ----------
+        padded : numpy array
+            The infected mask with a halo of radius rows and columns at each 
+            side, whose halo is overwritten.
+
+        edges : tuple
+            Whether the region reaches the top, bottom, left and right edges 
+            of the space. With periodic boundaries the space only wraps along
+            the axes where the region reaches both edges.
+
+        halo_rows : tuple, optional
+            The infected masks of the radius rows above and below a band of 
+            full rows, used as the halo of those sides instead, or None for the
+            sides that follow the rules above.
+
+        """
+
+        radius_rows, radius_cols = self.radius
+        top, bottom, left, right = edges
+        above, below = (None, None) if halo_rows is None else halo_rows
+        inner_cols = slice(radius_cols, padded.shape[-1] - radius_cols)
+
+        # the rows first, inside the columns of the region
+        if radius_rows:
+            if self.boundary == 'periodic' and top and bottom and above is None and below is None:
+                padded[..., :radius_rows, inner_cols] = padded[..., -2 * radius_rows:-radius_rows, inner_cols]
+                padded[..., -radius_rows:, inner_cols] = padded[..., radius_rows:2 * radius_rows, inner_cols]
+            else:
+                if above is None:
+                    self._fillSide(padded[..., :radius_rows, inner_cols], padded[..., radius_rows:2 * radius_rows, inner_cols][..., ::-1, :], top)
+                else:
+                    padded[..., :radius_rows, inner_cols] = above
+                if below is None:
+                    self._fillSide(padded[..., -radius_rows:, inner_cols], padded[..., -2 * radius_rows:-radius_rows, inner_cols][..., ::-1, :], bottom)
+                else:
+                    padded[..., -radius_rows:, inner_cols] = below
+
+        # then the columns along every row, which fills the corners
+        if radius_cols:
+            if self.boundary == 'periodic' and left and right:
+                padded[..., :radius_cols] = padded[..., -2 * radius_cols:-radius_cols]
+                padded[..., -radius_cols:] = padded[..., radius_cols:2 * radius_cols]
+            else:
+                self._fillSide(padded[..., :radius_cols], padded[..., radius_cols:2 * radius_cols][..., ::-1], left)
+                self._fillSide(padded[..., -radius_cols:], padded[..., -2 * radius_cols:-radius_cols][..., ::-1], right)
+
+    def _fillSide(self, side, mirror, at_edge):
+        """Fills one side of the halo with the mirrored space when it is beyond a
+        reflecting edge, and empties it otherwise.
+
+        """
+
+        if self.boundary == 'reflect' and at_edge:
+            side[...] = mirror
+        else:
+            side[...] = 0
+
+    def count(self, padded, out):
+        """Counts the infected neighbours of every position from the infected 
+        mask surrounded by its halo.
+
+        Parameters
+        ----------
+        padded : numpy array
+            The infected mask with its halo already filled.
+
+        out : numpy array
+            The array of type dtype, with the shape of the mask without its
+            halo, where the counts are written.
+
+        Returns
+        -------
+        count : numpy array
+            The out array.
+
+        """
+
+        rows, cols = out.shape[-2:]
+
+        if self.method == 'shift':
+            out[...] = 0
+            for row, col, weight in self._offsets:
+                neighbours = padded[..., row:row + rows, col:col + cols]
+                if weight == 1:
+                    np.add(out, neighbours, out=out, casting='unsafe')
+                else:
+                    out += (weight * neighbours).astype(out.dtype, copy=False)
+
+        elif self.method == 'box':
+            # the sum of every window, along the rows and then along the columns of the cumulative sums
+            box_rows, box_cols = self.kernel.shape
+            sums = np.cumsum(padded, axis=-2, dtype=np.int64)
+            sums = np.concatenate([sums[..., box_rows - 1:box_rows, :], sums[..., box_rows:, :] - sums[..., :-box_rows, :]], axis=-2)
+            sums = np.cumsum(sums, axis=-1, out=sums)
+            sums = np.concatenate([sums[..., box_cols - 1:box_cols], sums[..., box_cols:] - sums[..., :-box_cols]], axis=-1)
+            weight, missing = self._box
+            centre = padded[..., self.radius[0]:self.radius[0] + rows, self.radius[1]:self.radius[1] + cols]
+            np.subtract(weight * sums, missing * centre, out=out, casting='unsafe')
+
+        else:
+            # a correlation is a convolution with the flipped kernel, and away from the halo it does not wrap
+            shape = padded.shape[-2:]
+            if self._kernel_fft[0] != shape:
+                self._kernel_fft = (shape, np.fft.rfft2(self.kernel[::-1, ::-1], s=shape))
+            convolution = np.fft.irfft2(np.fft.rfft2(padded) * self._kernel_fft[1], s=shape)
+            convolution = convolution[..., 2 * self.radius[0]:, 2 * self.radius[1]:]
+            if self.dtype.kind == 'f':
+                np.maximum(convolution, 0, out=out)
+            else:
+                np.rint(convolution, out=convolution)
+                np.copyto(out, convolution, casting='unsafe')
+
+        return out
+
+
+class Network():
+    """ 
+    A class used to count the infected neighbours of every person from a 
+    contact network instead of a lattice. The network is stored as a CSR 
+    adjacency array: the contacts of person i are indices[indptr[i]:indptr[i+1]].
+    The counts are a sparse matrix-vector product, made by scattering the 
+    contacts of the infected people with a bincount when they are few, or by
+    summing the infected contacts of everybody with a reduceat otherwise. It 
+    can be used as the neighbourhood of a community whose space has a single
+    row with one position per person.
+
+
+    Attributes
+    ----------
+    nodes : int
+        The number of people in the network.
+
+    indptr : numpy array
+        1D int64 array with nodes + 1 values, where the contacts of each 
+        person start and end in indices.
+
+    indices : numpy array
+        1D array with the contacts of every person, int32 when it fits.
+
+    weights : numpy array
+        1D float64 array with the weight of every contact, or None.
+
+    symmetric : bool
+        Whether every contact appears in the rows of both people.
+
+    radius : tuple
+        Always (0, 0), since there is no halo around the space.
+
+    boundary : str
+        Always 'zero'.
+
+    method : str
+        Always 'network'.
+
+    dtype : numpy dtype
+        The type of the counts, int64, or float64 with weights.
+
+    total : float
+        The largest possible count, with every contact infected.
+
+
+    Methods
+    -------
+    count(infected, out)
+        Counts the infected contacts of every person from the infected mask.
+
+    """
+
+    radius = (0, 0)
+    boundary = 'zero'
+    method = 'network'
+
+    def __init__(self, indptr, indices, weights=None, symmetric=True):
+        """
+        Parameters
+        ----------
+        indptr : array-like
+            Where the contacts of each person start and end in indices.
+
+        indices : array-like
+            The contacts of every person.
+
+        weights : array-like, optional
+            The non-negative weight of every contact. By default every contact
+            counts as one.
+
+        symmetric : bool, optional
+            Whether every contact appears in the rows of both people, which 
+            saves building the transposed network. Default value is True.
+        """
+
+        indptr = np.asarray(indptr, dtype=np.int64)
+        nodes = indptr.size - 1
+        indices = np.asarray(indices, dtype=np.int32 if nodes < np.iinfo(np.int32).max else np.int64)
+        if nodes < 0 or indptr[0] != 0 or indptr[-1] != indices.size or np.any(np.diff(indptr) < 0):
+            raise ValueError('indptr must start at 0, grow and end at the number of contacts.')
+        if indices.size and (indices.min() < 0 or indices.max() >= nodes):
+            raise ValueError('The contacts must be people of the network.')
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+            if weights.shape != indices.shape or np.any(weights < 0):
+                raise ValueError('There must be one non-negative weight per contact.')
+
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.symmetric = symmetric
+        self.dtype = np.dtype(np.int64) if weights is None else np.dtype(np.float64)
+
+        # the largest number of contacts, or weight, of a single person
+        degrees = np.diff(indptr) if weights is None else np.add.reduceat(np.append(weights, 0), indptr[:-1]) * (np.diff(indptr) > 0)
+        self.total = degrees.max() if nodes else 0
+        self._transpose = None # the transposed network, built when needed
+
+    def __getstate__(self):
+        """Leaves the transposed network out when pickling.
+
+        """
+
+        state = self.__dict__.copy()
+        state['_transpose'] = None
+        return state
+
+    def count(self, infected, out):
+        """Counts the infected contacts of every person.
+
+        Parameters
+        ----------
+        infected : numpy array
+            The infected mask of the space, with one position per person along
+            the last axis, and one row per replicate if it is batched.
+
+        out : numpy array
+            The array of type dtype, with the shape of the mask, where the 
+            counts are written.
+
+        Returns
+        -------
+        count : numpy array
+            The out array.
+
+        """
+
+        positions = np.flatnonzero(infected)
+        people = positions % self.nodes
+        starts = self.indptr[people]
+        lengths = self.indptr[people + 1] - starts
+
+        if infected.size == self.nodes and lengths.sum() > self.indices.size // 2:
+            # most contacts are infected, so every person sums its own infected contacts
+            indptr, indices, weights = self._transposed()
+            contacts = infected.reshape(-1)[indices]
+            if weights is not None:
+                contacts = contacts * weights
+            counts = np.zeros(self.nodes, dtype=self.dtype)
+            reached = np.diff(indptr) > 0
+            counts[reached] = np.add.reduceat(contacts, indptr[:-1][reached], dtype=self.dtype)
+        else:
+            # the contacts of the infected people, each in the replicate of the infected person
+            position = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            contacts = self.indices[position] + np.repeat(positions - people, lengths)
+            counts = np.bincount(contacts, weights=None if self.weights is None else self.weights[position], minlength=infected.size)
+
+        np.copyto(out.reshape(-1), counts, casting='unsafe')
+        return out
+
+    def _transposed(self):
+        """Returns the network with the contacts reversed, where the row of each
+        person holds the people that can infect them.
+
+        """
+
+        if self.symmetric:
+            return self.indptr, self.indices, self.weights
+
+        if self._transpose is None:
+            order = np.argsort(self.indices, kind='stable')
+            sources = np.repeat(np.arange(self.nodes, dtype=self.indices.dtype), np.diff(self.indptr))[order]
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(self.indices, minlength=self.nodes))])
+            self._transpose = (indptr, sources, None if self.weights is None else self.weights[order])
+        return self._transpose
+
+
+class NetworkCommunity(Community):
+    """ 
+    A class used to represent a community whose contacts come from a contact
+    network instead of a square lattice. Its space has a single row with one
+    position per person, and its neighbourhood is a Network, so the infected
+    neighbours are counted with a sparse matrix-vector product. Since the 
+    contacts of a person can be anywhere in the row, the whole space is 
+    updated at every step. It works with Ensemble and Simulator like any other
+    Community.
+
+
+    Attributes
+    ----------
+    network : Network
+        The contact network, which is also the neighbourhood.
+
+    All the remaining attributes are the same as in Community.
+
+
+    Methods
+    -------
+    fromEdges(name, edges, nodes=None, weights=None, seed=None)
+        Creates a community from a list of contacts between pairs of people.
+
+    setNeighbourhood(kind='moore', radius=1, kernel=None, boundary='zero', method=None)
+        Raises a ValueError, since the neighbours are the contacts of the network.
+
+    All the remaining methods are inherited from Community.
+
+    """
+
+    def __init__(self, name, indptr, indices, weights=None, symmetric=True, seed=None):
+        """
+        Parameters
+        ----------
+        name : String
+            String that represents the name of this community.
+
+        indptr : array-like
+            Where the contacts of each person start and end in indices.
+
+        indices : array-like
+            The contacts of every person, whom they can infect.
+
+        weights : array-like, optional
+            The weight of every contact. By default every contact counts as one.
+
+        symmetric : bool, optional
+            Whether every contact appears in the rows of both people. Default
+            value is True.
+
+        seed : int or SeedSequence, optional
+            The seed of the random number generator of this community. By default
+            the generator is seeded with fresh entropy.
+        """
+
+        Community.__init__(self, name, 0, seed)
+
+        self.network = Network(indptr, indices, weights, symmetric) # the contacts of every person
+        self.neighbourhood = self.network # the infected neighbours are the infected contacts
+        self.space = np.zeros((1, self.network.nodes), dtype=np.uint8) # a single row with one position per person
+        self.population = self.space.size # the size of the population
+        self.susceptible = self.space.size # the current number of healthy people in the population
+        self.active_region = False # the contacts of a person can be anywhere in the space
+
+    @classmethod
+    def fromEdges(cls, name, edges, nodes=None, weights=None, seed=None):
+        """Creates a community from a list of contacts between pairs of people,
+        which go both ways.
+
+        Parameters
+        ----------
+        name : String
+            String that represents the name of this community.
+
+        edges : array-like
+            Array with shape (contacts, 2) with the two people of every contact.
+
+        nodes : int, optional
+            The number of people. By default the largest person plus one.
+
+        weights : array-like, optional
+            The weight of every contact. By default every contact counts as one.
+
+        seed : int or SeedSequence, optional
+            The seed of the random number generator of this community.
+
+        Returns
+        -------
+        community : NetworkCommunity
+            The new community.
+
+        """
+
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if nodes is None:
+            nodes = int(edges.max()) + 1 if edges.size else 0
+
+        # both directions of every contact, sorted by the first person with a single argsort
+        sources = np.concatenate([edges[:, 0], edges[:, 1]])
+        targets = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.argsort(sources, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=nodes))])
+        if weights is not None:
+            weights = np.tile(np.asarray(weights, dtype=np.float64), 2)[order]
+
+        return cls(name, indptr, targets[order], weights, True, seed)
+
+    def setNeighbourhood(self, kind='moore', radius=1, kernel=None, boundary='zero', method=None):
+        """The neighbours of each person are their contacts in the network, 
+        so a lattice neighbourhood cannot replace them.
+
+        Raises
+        ------
+        ValueError
+            Always. A new network is set by creating a new NetworkCommunity.
+
+        """
+
+        raise ValueError('The neighbours of a NetworkCommunity are the contacts of its network.')
+
+
+class Ensemble(Community):
+    """ 
+    A class used to advance several independent replicates of a Community at
+    once. The replicates are stacked into a single 3D numpy array with shape
+    (runs, rows, cols), so every step is performed with one set of numpy
+    operations for all of them, following the same rules as the Community.
+    The counts (susceptible, infected, recovered) are 1D numpy arrays with 
+    one value per replicate, and the SIR time series has shape (runs, 3, t+1).
+    Snapshots are not kept by default.
+
+
+    Attributes
+    ----------
+    runs : int
+        The number of replicates advanced together.
+
+    snapshot_replicate : int
+        The only replicate whose snapshots are kept, or None to keep the 
+        snapshots of all of them.
+    
+    All the remaining attributes are the same as in Community.
+
+
+    Methods
+    -------
+    resetSimulatedData()
+        Resets the simulated data of all the replicates.
+    
+    getReplicate(index)
+        Returns one of the replicates as a Community.
+
+    All the remaining methods are inherited from Community.
+
+    """
+
+    def __init__(self, community, runs, rng=None):
+        """
+        Parameters
+        ----------
+        community : Community
+            The community used as a template. Its name, size and probabilities
+            are copied into the ensemble.
+        
+        runs : int
+            The number of replicates to advance together.
+
+        rng : numpy Generator, SeedSequence or int, optional
+            The random number generator of the ensemble, or a seed to create it.
+            By default a new unseeded generator is created.
+        """
+
+        if community.band_rows is not None:
+            raise ValueError('The replicates of an Ensemble are kept in memory, so it cannot be made from a community stored in a file.')
+
+        Community.__init__(self, community.getName(), 0)
+        self._copySettings(community) # the population, occupancy, probabilities, maps and the rest of the settings
+
+        self.runs = runs # the number of replicates
+        self.snapshot_replicate = None # the snapshots of every replicate are kept if there are any
+        self.space = np.zeros((runs,) + community.getSpace().shape, dtype=community.getSpace().dtype) # one 2D space per replicate
+        self.snapshot_policy = ('off', None) # snapshots of every replicate are usually not needed
+        self.keep_snapshots = False # whether the snapshots are recorded
+        self.rng = np.random.default_rng(rng) # the random number generator shared by all the replicates
+        self.resetSimulatedData()
+
+    def resetSimulatedData(self):
+        """Resets the simulated data of all the replicates, in the same way as 
+        Community.resetSimulatedData does for a single one.
+
+        """
+
+        self.space = np.zeros_like(self.space) # numpy array that represents the physical space of every replicate
+        self._applyOccupancy() # the empty positions stay empty in every replicate
+        self.susceptible = np.full(self.runs, self.population) # the current number of healthy people in each replicate
+        self.infected = np.zeros(self.runs, dtype=int) # the current number of infected people in each replicate
+        self.recovered = np.zeros(self.runs, dtype=int) # the current number of recovered people in each replicate
+        self.immunised = np.zeros(self.runs, dtype=int) # the current number of immunised people in each replicate
+        self.snapshots = self._newSnapshots() # this will contain numpy arrays that represent each time step
+        self._resetSIR() # this contains a time series of the number of susceptible, infected, recovered per replicate
+        self.time = np.zeros(1) # this array will be the time array
+        self.peak_number_of_infections = np.zeros(self.runs) # the peak of infected people in each replicate
+        self.total_infections = np.zeros(self.runs) # the total number of infections in each replicate
+        self.duration_of_outbreak = np.zeros(self.runs, dtype=int) # the first step from which nobody is infected in each replicate
+        self._active_box = None # the boxes around the infected people of the replicates have to be found again
+        self._recoveries = None # the recoveries have to be drawn again
+        self._applySchedule(0, pulses=False) # the probabilities go back to the ones at the start of the schedule
+
+    def _newSnapshots(self):
+        """Returns an empty container for the snapshots, following the 
+        snapshot policy, which only keeps the ones of snapshot_replicate if it
+        is set.
+
+        """
+
+        snapshots = Community._newSnapshots(self)
+        if getattr(self, 'snapshot_replicate', None) is None:
+            return snapshots
+        return SnapshotReplicate(snapshots, self.snapshot_replicate)
+
+    def getReplicate(self, index):
+        """Returns one of the replicates as a Community, with its space, counts,
+        SIR time series, snapshots and results.
+
+        Parameters
+        ----------
+        index : int
+            The index of the replicate.
+
+        Returns
+        -------
+        community : Community
+            A new community holding a copy of the replicate.
+
+        """
+
+        replicate = Community(self.getName(), 0)
+        replicate._copySettings(self) # the same settings as every replicate, including the snapshot policy
+        replicate.space = self.space[index].copy()
+        replicate.susceptible = self.susceptible[index]
+        replicate.infected = self.infected[index]
+        replicate.recovered = self.recovered[index]
+        replicate.immunised = self.immunised[index]
+        replicate.SIR = self.SIR[index]
+        replicate.time = self.time
+        replicate.peak_number_of_infections = self.peak_number_of_infections[index]
+        replicate.total_infections = self.total_infections[index]
+        replicate.duration_of_outbreak = self.duration_of_outbreak[index]
+        replicate.snapshots = self.snapshots.select(index)
+
+        return replicate
+
+
+class Metapopulation(Ensemble):
+    """ 
+    A class used to advance several communities of the same size that are 
+    linked by migration. The communities are stacked into a single 3D numpy
+    array like the replicates of an Ensemble, and at every step each of them
+    imports infections from the infected people of the others, following a
+    migration matrix, with one set of numpy operations for all of them. The
+    probabilities are 1D numpy arrays with one value per community, and so 
+    are the per step arrays of the schedules of the communities, while the 
+    remaining settings are taken from the first community. A metapopulation
+    is a single simulation of the linked communities, so unlike an Ensemble
+    it does not hold several replicates. Communities of different shapes 
+    cannot share the stack, so they are not linked. With the 'zero' 
+    boundary, the empty positions of setOccupancy can give smaller 
+    communities the shape of the largest one.
+
+
+    Attributes
+    ----------
+    names : list
+        The names of the communities, in the order of the stack.
+
+    migration : numpy array
+        2D numpy array where the value at row i and column j is the expected
+        number of infections imported into community i per infected person
+        in community j at every step. The diagonal is zero, since the spread
+        inside a community is given by its space.
+
+    imported : numpy array
+        The number of infections imported into each community.
+
+    All the remaining attributes are the same as in Ensemble.
+
+
+    Methods
+    -------
+    simulateOneTimeStep()
+        Imports the infections of this step and advances every community.
+
+    getReplicate(index)
+        Returns one of the communities as a Community.
+
+    All the remaining methods are inherited from Ensemble.
+
+    """
+
+    def __init__(self, communities, migration, rng=None):
+        """
+        Parameters
+        ----------
+        communities : list
+            The communities to link, which must have the same shape. Their 
+            names and probabilities are copied into the metapopulation.
+        
+        migration : array-like
+            The migration matrix, with one row and column per community.
+
+        rng : numpy Generator, SeedSequence or int, optional
+            The random number generator of the metapopulation, or a seed to 
+            create it. By default a new unseeded generator is created.
+        """
+
+        communities = list(communities)
+        if any(community.getSpace().shape != communities[0].getSpace().shape for community in communities):
+            raise ValueError('The communities of a metapopulation must have the same shape.')
+
+        migration = np.array(migration, dtype=np.float64)
+        if migration.shape != (len(communities), len(communities)):
+            raise ValueError('The migration matrix must have one row and column per community.')
+        if np.any(migration < 0):
+            raise ValueError('The migration matrix must be non-negative.')
+        np.fill_diagonal(migration, 0)
+
+        Ensemble.__init__(self, communities[0], len(communities), rng)
+
+        self.names = [community.getName() for community in communities] # the names of the communities in the stack
+        self.name = '+'.join(self.names)
+        self.migration = migration # the expected infections imported into each community per infected person of every other
+        self.base_infection_probability = np.array([community.base_infection_probability for community in communities], dtype=np.float64)
+        self.infection_probability = np.array([community.infection_probability for community in communities], dtype=np.float64)
+        self.recovery_probability = np.array([community.recovery_probability for community in communities], dtype=np.float64)
+        if any(community.occupancy is not None for community in communities):
+            # each community keeps its own empty positions and population
+            shape = communities[0].getSpace().shape
+            self.occupancy = np.stack([np.ones(shape, dtype=bool) if community.occupancy is None else community.occupancy for community in communities])
+            self.population = np.array([community.getPopulation() for community in communities])
+            self.resetSimulatedData()
+        if any(community.schedule is not None for community in communities):
+            self._stackSchedules(communities)
+
+    def _stackSchedules(self, communities):
+        """Stacks the per step arrays of the schedules of the communities, with
+        one column per community. The arrays are extended to the longest 
+        schedule with their last values and no vaccination pulses, and a 
+        community without a schedule keeps its probabilities.
+
+        Parameters
+        ----------
+        communities : list
+            The communities of the metapopulation.
+
+        """
+
+        length = max(community._schedule['vaccinate'].shape[0] for community in communities if community._schedule is not None)
+        columns = {key: [] for key in ('base_infection_probability', 'infection_probability', 'recovery_probability', 'vaccinate')}
+        for community in communities:
+            for key, column in columns.items():
+                if community._schedule is None:
+                    values = np.full(length, 0 if key == 'vaccinate' else getattr(community, key), dtype=np.float64)
+                else:
+                    values = community._schedule[key]
+                    values = np.concatenate([values, np.full(length - values.size, 0 if key == 'vaccinate' else values[-1])])
+                column.append(values)
+
+        self.schedule = [community.schedule for community in communities]
+        self._schedule = {key: np.stack(column, axis=1) for key, column in columns.items()}
+        self._applySchedule(0, pulses=False)
+
+    def resetSimulatedData(self):
+        """Resets the simulated data of all the communities, including the 
+        number of imported infections.
+
+        """
+
+        Ensemble.resetSimulatedData(self)
+        self.imported = np.zeros(self.runs, dtype=int) # the number of infections imported into each community
+
+    def simulateOneTimeStep(self):
+        """Imports the infections of this step, which are then part of its 
+        counts, and advances every community with the same rules as an 
+        Ensemble.
+
+        """
+
+        if self.keep_snapshots and len(self.snapshots) == 0:
+            self.snapshots.start(self.getSpace())
+
+        self._importInfections()
+        Ensemble.simulateOneTimeStep(self)
+
+    def _importInfections(self):
+        """Draws the number of infections imported into every community from the
+        migration matrix and the current infected people, and infects that 
+        many random positions of each community. Imported infections that reach
+        people who are not susceptible are lost.
+
+        """
+
+        imports = self.rng.poisson(self.migration @ self.infected)
+        if not np.any(imports):
+            return
+
+        # random positions inside the community of each import, drawn all at once
+        rows, cols = self.space.shape[-2:]
+        if self.occupancy is None:
+            members = np.repeat(np.arange(self.runs), imports)
+            positions = np.unique(members * (rows * cols) + self.rng.integers(0, rows * cols, size=members.size))
+        else:
+            # only the occupied positions of each community can receive imports
+            occupied = getattr(self, '_occupied_positions', None)
+            if occupied is None or occupied[0] is not self.occupancy:
+                occupied = self._occupied_positions = (self.occupancy, np.flatnonzero(np.broadcast_to(self.occupancy, self.space.shape)))
+            sizes = np.broadcast_to(self.population, (self.runs,))
+            starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+            members = np.repeat(np.arange(self.runs), np.where(sizes > 0, imports, 0))
+            positions = np.unique(occupied[1][starts[members] + (self.rng.random(members.size) * sizes[members]).astype(np.int64)])
+        positions = positions[self.space.reshape(-1)[positions] == 0]
+
+        new_infected = self._changeState((Ellipsis,), positions, 1)
+        self.susceptible = self.susceptible - new_infected
+        self.infected = self.infected + new_infected
+        self.imported = self.imported + new_infected
+
+        # the box around the infected people of each community grows to hold the imported ones
+        if self._active_box is not None and positions.size > 0:
+            members = positions // (rows * cols)
+            infected_rows, infected_cols = (positions % (rows * cols)) // cols, positions % cols
+            boxes = self._active_box.copy()
+            boxes[boxes[:, 0] >= boxes[:, 1]] = (rows, 0, cols, 0)
+            np.minimum.at(boxes[:, 0], members, infected_rows)
+            np.maximum.at(boxes[:, 1], members, infected_rows + 1)
+            np.minimum.at(boxes[:, 2], members, infected_cols)
+            np.maximum.at(boxes[:, 3], members, infected_cols + 1)
+            boxes[boxes[:, 0] >= boxes[:, 1]] = 0
+            self._active_box = boxes
+
+    def getReplicate(self, index):
+        """Returns one of the communities as a Community, with its name, 
+        probabilities, space, counts, SIR time series, snapshots and results.
+
+        Parameters
+        ----------
+        index : int
+            The position of the community in the stack.
+
+        Returns
+        -------
+        community : Community
+            A new community holding a copy of that community.
+
+        """
+
+        replicate = Ensemble.getReplicate(self, index)
+        replicate.name = self.names[index]
+        if self.occupancy is not None and self.occupancy.ndim == 3:
+            replicate.occupancy = self.occupancy[index]
+            replicate.population = self.population[index]
+        replicate.base_infection_probability = self.base_infection_probability[index]
+        replicate.infection_probability = self.infection_probability[index]
+        replicate.recovery_probability = self.recovery_probability[index]
+        if self._schedule is not None:
+            # the schedule of the community, or the one given to all of them
+            replicate.schedule = self.schedule[index] if isinstance(self.schedule, list) else self.schedule
+            replicate._schedule = {key: values[:, index] if values.ndim == 2 else values for key, values in self._schedule.items()}
+
+        return replicate
+
+
+class Simulator():
+    """ 
+    A class used perform multiple simulations on several different communities
+    and store results in an organized manner.
+
+
+    Attributes
+    ----------
+    communitiesDict : dict
+        A python dictionary where the keys are the communities' names, and 
+        the values are Community's instances. These are the communities
+        where the simulations are going to be run with.
+    
+    resultsDict : dict
+        A python dictionary where the keys are the communities' names, and
+        the values are the dictionaries containing the results of all the
+        different simulations. These result dictionaries have five keys:
+        'max_infected_array' which is a numpy array with the peak number
+        of infections of every single simulation run with that Community, 
+        'total_infected_array' which is also a numpy array with the 
+        total number of people that are infectios or where infections at 
+        some point during the simulated time, 'duration_array' with the
+        first step from which nobody was infected anymore, or the number of 
+        steps if the outbreak did not end, 'seed_array' with the seed of the random
+        number generator of every simulation, and 'index_array' with its 
+        position among the simulations that share that seed. The simulations
+        of an Ensemble, or the communities of a Metapopulation, share the 
+        random stream of their work unit, so each of them is identified by 
+        the pair of its seed and index, and replaying one of them runs its
+        whole work unit again. A smaller ensembleSize bounds that cost.
+
+    seedSequence : numpy SeedSequence
+        The master seed sequence, from which the seeds of all the simulations
+        are spawned.
+
+    parallel_threshold : int
+        The smallest number of cell updates (population times simulations times
+        steps) for which the simulations are distributed across processes.
+
+    migration : numpy array
+        The migration matrix that links the communities, in the order of 
+        communitiesDict, or None if they are independent. See setMigration.
+    
+
+    Methods
+    -------
+    simulate(self, numberOfSimulations, simulationSteps, initiallyInfected=1, plot=False, ensemble=False, processes=1, snapshotPolicy='off', snapshotValue=None, ensembleSize=None, schedule=None):
+        Perfomrs the inicated number of simulations throughout all the communities 
+        in the dictionary of communities. The simulations of each Community can
+        be advanced together as an Ensemble, and distributed across processes.
+        Communities linked by migration are advanced together as a 
+        Metapopulation. No snapshots are recorded unless a snapshot policy is
+        given.
+
+    replay(name, simulation, snapshotPolicy='all', snapshotValue=None)
+        Runs again one of the simulations stored in resultsDict from its seed,
+        recording its SIR time series and snapshots.
+
+    setMigration(migration)
+        Links the communities by a migration matrix, so they are simulated 
+        together as a Metapopulation.
+
+    """
+
+    def __init__(self, communitiesDict, seed=None):
+        """
+        Parameters
+        ----------
+        communitiesDict : dict
+            A python dictionary where the keys are the communities' names, and 
+            the values are Community's instances. These are the communities
+            where the simulations are going to be run with.
+
+        seed : int, optional
+            The master seed of all the simulations. With the same seed, the same
+            calls to simulate give the same results regardless of the number of
+            processes. By default fresh entropy is used.
+
+        """
+
+        # assign the dictionary of communites 
+        self.communitiesDict = communitiesDict
+
+        # create the dictionary of results, and populate it.
+        self.resultsDict = {}
+
+        for name in communitiesDict.keys():
+            self.resultsDict[name] = {'max_infected_array': np.zeros(0),
+                                      'total_infected_array': np.zeros(0),
+                                      'duration_array': np.zeros(0),
+                                      'seed_array': np.zeros(0, dtype=np.uint64),
+                                      'index_array': np.zeros(0, dtype=np.int64)}
+
+        # ADD AN AVERAGE SIR CURVE
+
+        # jobs with fewer cell updates than this are not worth starting a pool of processes
+        self.parallel_threshold = 10**8
+
+        # every call to simulate spawns the seeds of its simulations from here
+        self.seedSequence = np.random.SeedSequence(seed)
+
+        # what is needed to replay every simulation in resultsDict, in the same order
+        self._replicates = {name: [] for name in communitiesDict.keys()}
+
+        # the communities are independent unless they are linked by migration
+        self.migration = None
+
+
+    def simulate(self, numberOfSimulations, simulationSteps, initiallyInfected=1, plot=False, ensemble=False, processes=1, 
+                 snapshotPolicy='off', snapshotValue=None, ensembleSize=None, schedule=None):
+        """Perfomrs the inicated number of simulations throughout all the 
+        communities in the dictionary of communities. Every work unit runs on
+        a copy of its Community, so the communities in the dictionary keep 
+        their own settings, schedule, random generator and simulated data.
+
+        Parameters
+        ----------
+        numberOfSimulations: int
+            The total number of simulations to be performed with each Community.
+        simulationSteps : int
+            The number of total steps in the simulations.
+        initiallyInfected : int or list, optional
+            The initial number of infected people in each simulation. With 
+            communities linked by migration, it can be a list with one number
+            per community of communitiesDict. The default value is set to 1.
+        plot : bool, optional
+            Boolean to indicate if the SIR plots should be displayed. Defaul value
+            is set to False.
+        ensemble : bool, optional
+            Boolean to indicate if all the simulations of a Community should be
+            advanced together as an Ensemble instead of one after the other. 
+            It cannot be used with communities linked by migration, whose 
+            simulations are each a single Metapopulation. Default value is set
+            to False.
+        ensembleSize : int or None, optional
+            The largest number of simulations in a single Ensemble. The 
+            simulations of a Community are split into Ensembles of this size, 
+            which are the work units distributed across processes. None puts all
+            of them in one Ensemble. Default value is set to None.
+        processes : int or None, optional
+            The number of worker processes used to run the simulations. Every 
+            (community, simulation) pair, or every Ensemble, is a separate work
+            unit with its own random stream, and the results are stored in the
+            same order as in a serial run, so they do not depend on the number
+            of processes. None uses all the 
+            available cores. Jobs smaller than parallel_threshold cell updates 
+            are always run serially. Default value is set to 1.
+        snapshotPolicy : str, optional
+            The snapshot policy given to the communities, see 
+            Community.setSnapshotPolicy. Default value is set to 'off', since 
+            the snapshots of a simulation are discarded by the next one.
+        snapshotValue : int or list, optional
+            The value of the snapshot policy. Default value is set to None.
+        schedule : dict, optional
+            The schedule of parameter changes given to every community, see
+            Community.setSchedule, also when they are linked by migration. It 
+            is kept with the settings of the run, so replays use it too. 
+            Default value is set to None, which keeps the schedules the 
+            communities already have.
+
+        """
+
+        if processes is None:
+            processes = os.cpu_count()
+
+        # the amount of work, measured in cell updates, decides if a pool is worth starting
+        work = sum(community.getPopulation() for community in self.communitiesDict.values()) * numberOfSimulations * simulationSteps
+        parallel = processes > 1 and work >= self.parallel_threshold
+
+        # split the simulations of every community into work units, which do not depend on the number of processes
+        if self.migration is not None:
+            if ensemble:
+                raise ValueError('Communities linked by migration are simulated as a Metapopulation, one simulation at a time, without ensembles.')
+            # every simulation advances all the linked communities together, as a single work unit
+            sources = {None: Metapopulation(self.communitiesDict.values(), self.migration)}
+            units = [(None, len(self.communitiesDict))] * numberOfSimulations
+        else:
+            sources = self.communitiesDict
+            units = []
+            for name in self.communitiesDict.keys():
+                if ensemble:
+                    size = numberOfSimulations if ensembleSize is None else ensembleSize
+                    units += [(name, min(size, numberOfSimulations - first)) for first in range(0, numberOfSimulations, size)]
+                else:
+                    units += [(name, 1)] * numberOfSimulations
+
+        # each work unit gets its own random stream, spawned from the master seed sequence
+        seeds = [int(child.generate_state(1, np.uint64)[0]) for child in self.seedSequence.spawn(len(units))]
+
+        # keep the settings of the communities without their spaces, so any simulation can be replayed from its seed
+        templates = {name: community._blankCopy() for name, community in sources.items()}
+
+        # everything a work unit needs besides its community, its size and its seed
+        settings = {'simulationSteps': simulationSteps,
+                    'initiallyInfected': initiallyInfected,
+                    'ensemble': ensemble,
+                    'metapopulation': self.migration is not None,
+                    'snapshotPolicy': (snapshotPolicy, snapshotValue),
+                    'schedule': copy.deepcopy(schedule),
+                    'keepSIR': plot}
+
+        if parallel and len(units) > 1:
+            payloads = [(templates[name], runs, seed, settings) for (name, runs), seed in zip(units, seeds)]
+            with multiprocessing.Pool(min(processes, len(units))) as pool:
+                results = pool.map(_simulateWorkUnit, payloads, chunksize=max(1, len(units) // (4 * processes)))
+        else:
+            results = [_simulateWorkUnit((templates[name], runs, seed, settings)) for (name, runs), seed in zip(units, seeds)]
+
+        # the community of every simulation of each unit, which are all the linked communities in a metapopulation
+        owners = [list(self.communitiesDict.keys()) if name is None else [name] * runs for name, runs in units]
+
+        # merge the results back in the order of the work units, with a single concatenation per array
         for name in self.communitiesDict.keys():
+            self._replicates[name] += [(templates[unitName], settings, seed, index, runs) 
+                                       for (unitName, runs), seed, unitOwners in zip(units, seeds, owners) 
+                                       for index, owner in enumerate(unitOwners) if owner == name]
+
+            for key in ('max_infected_array', 'total_infected_array', 'duration_array', 'seed_array', 'index_array'):
+                parts = [np.ravel(result[key]) if unitName == name else np.ravel(result[key])[unitOwners.index(name)][np.newaxis]
+                         for (unitName, _), result, unitOwners in zip(units, results, owners) if name in unitOwners]
+                self.resultsDict[name][key] = np.concatenate([self.resultsDict[name][key]] + parts)
+
+        for result, unitOwners in zip(results, owners):
+            # create the plot
+            if plot:
+                for name, SIR in zip(unitOwners, result['SIR']):
+                    self._plotSIR(name, np.arange(simulationSteps + 1), SIR)
+
+    def setMigration(self, migration):
+        """Links the communities by a migration matrix. From then on, every 
+        simulation advances all the communities together as a Metapopulation,
+        where they exchange infections at every step.
+
+        Parameters
+        ----------
+        migration : array-like
+            2D array where the value at row i and column j is the expected 
+            number of infections imported into the i-th community of 
+            communitiesDict per infected person of the j-th one at every step.
+            None makes the communities independent again. The communities 
+            must have the same shape, see Metapopulation.
+
+        """
+
+        if migration is not None:
+            # check the matrix and the communities once, before any simulation
+            Metapopulation(self.communitiesDict.values(), migration)
+            migration = np.array(migration, dtype=np.float64)
+
+        self.migration = migration
+
+    def replay(self, name, simulation, snapshotPolicy='all', snapshotValue=None):
+        """Runs again one of the simulations stored in resultsDict, with its 
+        seed and the settings and Community it had, but recording its SIR time
+        series and snapshots. Simulations that were part of an Ensemble or a
+        Metapopulation share its random stream, so they are replayed by running
+        all of it again, and the simulation is picked by its index_array. Only
+        the snapshots of that simulation are kept.
+
+        Parameters
+        ----------
+        name : str
+            The name of the community.
+        simulation : int
+            The position of the simulation in the arrays of resultsDict[name].
+        snapshotPolicy : str, optional
+            The snapshot policy used in the replay, see 
+            Community.setSnapshotPolicy. Default value is set to 'all'. A 
+            community whose space is stored in a file is replayed without
+            snapshots, only with its SIR time series.
+        snapshotValue : int or list, optional
+            The value of the snapshot policy. Default value is set to None.
+
+        Returns
+        -------
+        community : Community
+            A new community holding the replayed simulation.
+
+        """
+
+        template, settings, seed, index, runs = self._replicates[name][simulation]
+        batched = settings['ensemble'] or settings.get('metapopulation', False)
+        if template.band_rows is not None:
+            # no snapshots are recorded of a space stored in a file
+            snapshotPolicy, snapshotValue = 'off', None
+
+        # the whole work unit runs again, but only the snapshots of the replayed simulation are kept
+        settings = dict(settings, snapshotPolicy=(snapshotPolicy, snapshotValue), snapshotReplicate=index if batched else None, keepSIR=False)
+        community = _runWorkUnit(template, runs, seed, settings)
+        if batched:
+            community = community.getReplicate(index)
+
+        return community
+
+    def _plotSIR(self, name, time, SIR):
+        """Displays the SIR plot of a single simulation.
+
+        """
+
+        plt.scatter(time, SIR[0,:], label='Susceptible', s=5)
+        plt.scatter(time, SIR[1,:], label='Infectious', s=5)
+        plt.scatter(time, SIR[2,:], label='Recovered', s=5)
+        plt.title(name)
+        plt.grid()
+        plt.legend()
+        plt.show()
+
+
+def _simulateWorkUnit(payload):
+    """Performs one work unit of Simulator.simulate, which is either a single
+    simulation of a Community or an Ensemble of several of them, and returns
+    its results. This is a module level function so that it can be sent to
+    worker processes.
+
+    Parameters
+    ----------
+    payload : tuple
+        The community, the number of simulations, the integer seed of the unit 
+        and a dictionary with the settings of Simulator.simulate: the number of
+        steps, the initial number of infected people, whether to use an 
+        Ensemble, the snapshot policy, the schedule and whether to return the 
+        SIR time series.
+
+    Returns
+    -------
+    results : dict
+        The 'max_infected_array', 'total_infected_array', 'duration_array', 
+        'seed_array' and 'index_array' of the unit, and a list with the SIR 
+        time series under 'SIR' if they were requested.
+
+    """
+
+    community, runs, seed, settings = payload
+    community = _runWorkUnit(community, runs, seed, settings)
+
+    results = {'max_infected_array': community.peak_number_of_infections,
+               'total_infected_array': community.total_infections,
+               'duration_array': community.duration_of_outbreak,
+               'seed_array': np.full(runs, seed, dtype=np.uint64),
+               'index_array': np.arange(runs, dtype=np.int64)}
+    if settings['keepSIR']:
+        results['SIR'] = list(community.SIR.reshape(-1, 3, community.SIR.shape[-1]).copy())
+
+    return results
+
+
+def _runWorkUnit(community, runs, seed, settings):
+    """Runs the simulations of one work unit on a copy of the community, which
+    is left unchanged. Given the same community, seed and settings, the 
+    simulations are always the same.
+
+    Parameters
+    ----------
+    community : Community
+        The community to simulate, which is used as a template for an Ensemble.
+    runs : int
+        The number of simulations in the unit.
+    seed : int
+        The seed of the random number generator of the unit.
+    settings : dict
+        The settings of Simulator.simulate.
+
+    Returns
+    -------
+    community : Community or Ensemble
+        The simulated community, which holds the results.
+
+    """
+
+    simulationSteps = settings['simulationSteps']
+    initiallyInfected = settings['initiallyInfected']
+
+    # the schedule, random generator and snapshot policy of the unit never reach the community it was given
+    community = community._blankCopy()
+    if community.band_rows is not None:
+        # a space stored in a file gets a temporary file of its own
+        community.setOutOfCore(band_rows=community.band_rows)
+
+    if settings.get('schedule') is not None:
+        community.setSchedule(settings['schedule'])
 
-            for n in np.arange(numberOfSimulations):
+    if settings['ensemble']:
+        community = Ensemble(community, runs, rng=seed)
+    else:
+        # make sure that the community uses the random stream of this unit
+        community.rng = np.random.default_rng(seed)
+    if isinstance(community, Ensemble):
+        # a replay only keeps the snapshots of the simulation being replayed
+        community.snapshot_replicate = settings.get('snapshotReplicate')
 
-                # make sure that the community is reset
-                self.communitiesDict[name].resetSimulatedData()
+    # this also makes sure that the community is reset
+    community.setSnapshotPolicy(*settings['snapshotPolicy'])
+    community.resetSimulatedData()
 
-                # assign the simulation time for the community.
-                self.communitiesDict[name].time = np.arange(simulationSteps + 1)
+    # assign the simulation time for the community, and make room for it in the SIR time series
+    community.time = np.arange(simulationSteps + 1)
+    community.reserveSteps(simulationSteps)
 
+    # add initially infected
+    community.addInitiallyInfected(initiallyInfected)
 
-                # add initially infected
-                self.communitiesDict[name].addInitiallyInfected(initiallyInfected)
+    # perform a single simulation, or all the simulations of the ensemble at once, until nobody is infected
+    for step in np.arange(simulationSteps):
+        if np.all(community.infected == 0) and not community._changesPending():
+            break
+        community.simulateOneTimeStep()
 
-                # perform a single simulation for each community
-                for _ in np.arange(simulationSteps):
-                    self.communitiesDict[name].simulateOneTimeStep()
-                
-                # update the max number of infected and append the result
-                self.communitiesDict[name].peak_number_of_infections = np.max(self.communitiesDict[name].SIR[1:])
+    # once the infection has died out nothing changes, so the remaining steps are filled in directly
+    community.fillRemainingSteps(simulationSteps + 1 - community.SIR.shape[-1])
 
-                self.resultsDict[name]['max_infected_array'] = np.append(self.resultsDict[name]['max_infected_array'], 
-                                                                        self.communitiesDict[name].peak_number_of_infections) 
+    # the step after the last one with infected people, or the last step if the outbreak did not end, 
+    # so a community of a metapopulation that starts without infected people is not taken as extinct
+    infected = community.SIR[..., 1, :] > 0
+    last = infected.shape[-1] - 1 - np.argmax(infected[..., ::-1], axis=-1)
+    community.duration_of_outbreak = np.where(infected[..., -1], simulationSteps, np.where(np.any(infected, axis=-1), last + 1, 0))
 
+    # update the max number of infected
+    community.peak_number_of_infections = np.max(community.SIR[..., 1, :], axis=-1)
 
-                # append the total number of people that are or were infected at the time step where the outbreak ends
-                self.communitiesDict[name].total_infections = self.communitiesDict[name].getRecovered() + self.communitiesDict[name].getInfected()
+    # the total number of people that are or were infected at the time step where the outbreak ends
+    community.total_infections = community.recovered + community.infected
 
-                self.resultsDict[name]['total_infected_array'] = np.append(self.resultsDict[name]['total_infected_array'], 
-                                                                        self.communitiesDict[name].total_infections)
-                
-                # create the plot
-                if plot:
-                    plt.scatter(self.communitiesDict[name].time, self.communitiesDict[name].SIR[0,:], label='Susceptible', s=5)
-                    plt.scatter(self.communitiesDict[name].time, self.communitiesDict[name].SIR[1,:], label='Infectious', s=5)
-                    plt.scatter(self.communitiesDict[name].time, self.communitiesDict[name].SIR[2,:], label='Recovered', s=5)
-                    plt.title(name)
-                    plt.grid()
-                    plt.legend()
-                    plt.show()
\ No newline at end of file
+    return community
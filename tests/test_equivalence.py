@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import cellare
+
+
+def _community(community=None):
+    if community is None:
+        community = cellare.Community('test', (15, 20), seed=3)
+    community.setBaseInfectionProbability(0.4)
+    community.calculateInfectionProbability(0)
+    community.setRecoveryProbability(0.3)
+    community.verify_counts = True
+    return community
+
+
+def _run(community, positions, steps=25):
+    community.getSpace().reshape(-1)[positions] = 1
+    community.countStates()
+    for _ in range(steps):
+        community.simulateOneTimeStep()
+    return community
+
+
+@pytest.mark.parametrize('boundary', ['zero', 'periodic'])
+def test_table_driven_sir_matches_fast_step(boundary):
+    # the same SIR model with its probabilities given explicitly is not the fast one
+    model = cellare.CompartmentModel(['S', 'I', 'R'], [('S', 'I', 'exposure', 0.4), ('I', 'R', 'probability', 0.3)], ['I'])
+    assert not model.fast
+
+    fast = _community()
+    table = _community()
+    table.setCompartmentModel(model)
+    for community in (fast, table):
+        community.setNeighbourhood('moore', 1, boundary=boundary)
+        _run(community, [0, 47, 160])
+
+    # both steps draw one number per candidate in the same order, so they agree draw for draw
+    assert np.array_equal(fast.getSpace(), table.getSpace())
+    assert np.array_equal(fast.SIR, table.SIR)
+
+
+def test_moore_network_matches_lattice():
+    rows, cols = 15, 20
+    cells = np.arange(rows * cols).reshape(rows, cols)
+    edges = np.concatenate([np.stack([cells[:-1, :].ravel(), cells[1:, :].ravel()], axis=1),
+                            np.stack([cells[:, :-1].ravel(), cells[:, 1:].ravel()], axis=1),
+                            np.stack([cells[:-1, :-1].ravel(), cells[1:, 1:].ravel()], axis=1),
+                            np.stack([cells[:-1, 1:].ravel(), cells[1:, :-1].ravel()], axis=1)])
+
+    lattice = _run(_community(), [0, 47, 160])
+    network = _run(_community(cellare.NetworkCommunity.fromEdges('test', edges, rows * cols, seed=3)), [0, 47, 160])
+
+    # the people are numbered row by row, so the network draws for the same people in the same order
+    assert np.array_equal(lattice.getSpace().ravel(), network.getSpace().ravel())
+    assert np.array_equal(lattice.SIR, network.SIR)
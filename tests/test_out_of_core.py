@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import cellare
+
+
+def _community(boundary, kind, radius, band_rows=None):
+    community = cellare.Community('test', (12, 12), seed=0)
+    community.setBaseInfectionProbability(1)
+    community.calculateInfectionProbability(0)
+    community.setRecoveryProbability(1)
+    community.setNeighbourhood(kind=kind, radius=radius, boundary=boundary)
+    if band_rows is not None:
+        community.setOutOfCore(band_rows=band_rows)
+    community.verify_counts = True
+    return community
+
+
+@pytest.mark.parametrize('boundary', ['zero', 'reflect', 'periodic'])
+@pytest.mark.parametrize('kind, radius', [('moore', 1), ('von_neumann', 2)])
+@pytest.mark.parametrize('band_rows', [1, 4, 5, 64])
+def test_out_of_core_matches_in_memory(boundary, kind, radius, band_rows):
+    # with probability 1 both ways of stepping are deterministic, so they must agree exactly
+    spaces = []
+    for rows in (None, band_rows):
+        community = _community(boundary, kind, radius, rows)
+        community.getSpace()[:4] = 2
+        community.getSpace()[3, 6] = 1
+        community.getSpace()[11, 0] = 1
+        community.countStates()
+        for _ in range(8):
+            community.simulateOneTimeStep()
+        spaces.append((np.array(community.getSpace()), community.SIR.copy()))
+
+    assert np.array_equal(spaces[0][0], spaces[1][0])
+    assert np.array_equal(spaces[0][1], spaces[1][1])
+
+
+@pytest.mark.parametrize('boundary', ['zero', 'periodic'])
+@pytest.mark.parametrize('placement', ['random', 'region', 'mask', 'ring'])
+def test_out_of_core_immunise_matches_in_memory(boundary, placement):
+    mask = np.zeros((12, 12), dtype=bool)
+    mask[::3] = True
+    spaces = []
+    for rows in (None, 4):
+        community = _community(boundary, 'moore', 1, rows)
+        community.getSpace()[0, 5] = 1
+        community.getSpace()[7, 11] = 1
+        community.countStates()
+        community.immunise(1, placement, region=(2, 9, 3, 8), mask=mask)
+        spaces.append((np.array(community.getSpace()), community.immunised))
+
+    assert np.array_equal(spaces[0][0], spaces[1][0])
+    assert spaces[0][1] == spaces[1][1]
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import cellare
+
+
+def _simulator():
+    community = cellare.Community('test', (20, 20))
+    community.setBaseInfectionProbability(0.3)
+    community.calculateInfectionProbability(0)
+    community.setRecoveryProbability(0.2)
+    simulator = cellare.Simulator({'test': community}, seed=7)
+    simulator.parallel_threshold = 0
+    return simulator
+
+
+@pytest.mark.parametrize('ensemble', [False, True])
+def test_replay_reproduces_stored_results(ensemble):
+    simulator = _simulator()
+    simulator.simulate(6, 30, initiallyInfected=2, ensemble=ensemble, ensembleSize=4)
+    results = simulator.resultsDict['test']
+
+    for simulation in range(6):
+        community = simulator.replay('test', simulation)
+        assert community.peak_number_of_infections == results['max_infected_array'][simulation]
+        assert community.total_infections == results['total_infected_array'][simulation]
+        assert community.duration_of_outbreak == results['duration_array'][simulation]
+        # the snapshots end with the last space of the simulation
+        assert np.array_equal(community.snapshots[len(community.snapshots) - 1], community.getSpace())
+
+
+@pytest.mark.parametrize('ensemble', [False, True])
+def test_results_do_not_depend_on_processes(ensemble):
+    results = []
+    for processes in (1, 4):
+        simulator = _simulator()
+        simulator.simulate(8, 30, initiallyInfected=2, ensemble=ensemble, ensembleSize=3, processes=processes)
+        results.append(simulator.resultsDict['test'])
+
+    for key in results[0]:
+        assert np.array_equal(results[0][key], results[1][key])